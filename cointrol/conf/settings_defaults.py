@@ -64,3 +64,83 @@ TEMPLATES = [
         },
     },
 ]
+
+
+# Bitstamp API root URL; `python -m cointrol.trader.simulator` serves
+# a simulated exchange at http://127.0.0.1:8001/api for testing.
+COINTROL_BITSTAMP_API_URL = 'https://www.bitstamp.net/api'
+
+# Bitstamp API HTTP transport, see `cointrol.trader.transport.HTTPTransport`.
+COINTROL_BITSTAMP_TRANSPORT = {
+    'max_clients': 4,
+    'connect_timeout': 5,
+    'request_timeout': 15,
+    'timeouts': {
+        '/ticker/': 5,
+        '/user_transactions/': 30,
+    },
+}
+
+# Maximum number of orders a grid strategy cancels and places at once;
+# fewer while the API request budget is low.
+COINTROL_GRID_BATCH = 10
+
+# Paper trading while `COINTROL_DO_TRADE` is off: the account is simulated
+# and orders fill against the live ticker, see `cointrol.trader.paper`.
+# `None` to disable, or the initial balances and fee, e.g.,
+# ``{'usd': '1000.00', 'btc': '0', 'fee': '0.25'}``.
+COINTROL_PAPER_TRADING = None
+
+# Path of a file to record all Bitstamp API exchanges to, for replaying
+# them with `cointrol.trader.benchmark`.
+COINTROL_BITSTAMP_RECORD = None
+
+# Bitstamp API request budget, see `cointrol.trader.ratelimit.RateLimiter`.
+COINTROL_BITSTAMP_RATE_LIMIT = {
+    'rate': 0.8,
+    'capacity': 100,
+}
+
+# Seconds before a Bitstamp API call (including time spent waiting
+# for the rate limiter) is given up, see `AsyncBitstampClient`.
+COINTROL_BITSTAMP_TIMEOUT = 60
+
+# Ticker write buffering, see `cointrol.trader.persistence.TickerWriter`.
+COINTROL_TICKER_BUFFER = {
+    'max_size': 100,
+    'max_delay': 30,
+}
+
+# Thread pools for blocking calls, see
+# `cointrol.trader.executor.BlockingExecutor`. The trader's in-memory
+# state expects its database work to run on a single thread.
+COINTROL_DB_EXECUTOR = {
+    'max_workers': 1,
+    'max_pending': 100,
+}
+COINTROL_REDIS_EXECUTOR = {
+    'max_workers': 2,
+    'max_pending': 1000,
+}
+
+# Redis connection pool of the trader; `redis.BlockingConnectionPool`
+# arguments.
+COINTROL_REDIS_POOL = {
+    'max_connections': 4,
+}
+
+# Batched publishing of model changes and monitoring beacons, see
+# `cointrol.trader.publisher.RedisPublisher`.
+COINTROL_REDIS_PUBLISHER = {
+    'window': .05,
+    'max_buffer': 1000,
+    'max_batch': 100,
+}
+
+# Number of recent tickers the live market indicators are computed from
+# (and warmed up with on start), see `cointrol.trader.indicators.Market`.
+COINTROL_MARKET_HISTORY = 1000
+
+# Live market data WebSocket, see `cointrol.trader.stream.MarketStream`.
+# Set to `None` to poll the REST ticker instead.
+COINTROL_BITSTAMP_STREAM_URL = 'wss://ws.bitstamp.net'
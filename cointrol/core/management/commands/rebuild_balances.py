@@ -0,0 +1,23 @@
+"""
+Recompute the inferred balances of all transactions in one pass.
+
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cointrol.core.models import Account, LEDGER_ORDER, carry_balances
+
+
+class Command(BaseCommand):
+    help = 'Recompute the running balances inferred from transactions.'
+
+    def handle(self, *args, **options):
+        for account in Account.objects.all():
+            transactions = account.transactions\
+                .order_by(*LEDGER_ORDER)\
+                .select_related('balance')
+            with transaction.atomic():
+                usd_balance, btc_balance = carry_balances(
+                    transactions.iterator())
+            self.stdout.write('{}: ${} | {} BTC'.format(
+                account, usd_balance, btc_balance))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_tickers(apps, schema_editor):
+    Ticker = apps.get_model('core', 'Ticker')
+    duplicates = Ticker.objects\
+        .values('timestamp')\
+        .annotate(count=Count('id'), first_id=Min('id'))\
+        .filter(count__gt=1)
+    for duplicate in duplicates:
+        Ticker.objects\
+            .filter(timestamp=duplicate['timestamp'])\
+            .exclude(id=duplicate['first_id'])\
+            .delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_auto_20171103_2342'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_tickers,
+                             migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='ticker',
+            name='until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ticker',
+            name='timestamp',
+            field=models.DateTimeField(unique=True),
+        ),
+    ]
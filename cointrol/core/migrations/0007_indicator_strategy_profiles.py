@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:41
+from __future__ import unicode_literals
+
+import cointrol.core.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_transaction_account_datetime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BollingerStrategyProfile',
+            fields=[
+                ('tradingstrategyprofile_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='core.TradingStrategyProfile')),
+                ('period', models.PositiveSmallIntegerField(default=20, help_text='ticks')),
+                ('width', models.DecimalField(decimal_places=2, default=2, help_text='standard deviations', max_digits=4)),
+            ],
+            options={
+                'db_table': 'strategy_profile_bollinger',
+            },
+            bases=('core.tradingstrategyprofile',),
+        ),
+        migrations.CreateModel(
+            name='EMAStrategyProfile',
+            fields=[
+                ('tradingstrategyprofile_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='core.TradingStrategyProfile')),
+                ('period', models.PositiveSmallIntegerField(default=100, help_text='ticks')),
+                ('buy', cointrol.core.fields.PercentField(decimal_places=3, max_digits=6)),
+                ('sell', cointrol.core.fields.PercentField(decimal_places=3, max_digits=6)),
+            ],
+            options={
+                'db_table': 'strategy_profile_ema',
+            },
+            bases=('core.tradingstrategyprofile',),
+        ),
+    ]
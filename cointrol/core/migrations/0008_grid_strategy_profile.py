@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:48
+from __future__ import unicode_literals
+
+import cointrol.core.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_indicator_strategy_profiles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GridStrategyProfile',
+            fields=[
+                ('tradingstrategyprofile_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='core.TradingStrategyProfile')),
+                ('levels', models.PositiveSmallIntegerField(default=5, help_text='orders on each side')),
+                ('step', cointrol.core.fields.PercentField(decimal_places=3, help_text='distance between the orders', max_digits=6)),
+                ('amount', cointrol.core.fields.AmountField(decimal_places=8, default=0, help_text='BTC per order', max_digits=30)),
+            ],
+            options={
+                'db_table': 'strategy_profile_grid',
+            },
+            bases=('core.tradingstrategyprofile',),
+        ),
+    ]
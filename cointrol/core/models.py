@@ -1,7 +1,6 @@
 from collections import OrderedDict
 
 from django.db import models
-from django.db.models import Sum
 from django.db.models.signals import post_save
 from django.utils import timezone
 from django.dispatch import receiver
@@ -140,6 +139,56 @@ class FixedStrategyProfile(TradingStrategyProfile):
             buy=self.buy, sell=self.sell)
 
 
+class EMAStrategyProfile(TradingStrategyProfile):
+    """Configuration for trading around the exponential moving average."""
+    period = models.PositiveSmallIntegerField(default=100,
+                                              help_text='ticks')
+    buy = PercentField()
+    sell = PercentField()
+
+    class Meta:
+        db_table = 'strategy_profile_ema'
+
+    def __str__(self):
+        return 'EMA({period}) buy at {buy}%, sell at {sell}%'.format(
+            period=self.period, buy=self.buy, sell=self.sell)
+
+
+class BollingerStrategyProfile(TradingStrategyProfile):
+    """Configuration for trading at the Bollinger bands."""
+    period = models.PositiveSmallIntegerField(default=20,
+                                              help_text='ticks')
+    width = models.DecimalField(max_digits=4, decimal_places=2, default=2,
+                                help_text='standard deviations')
+
+    class Meta:
+        db_table = 'strategy_profile_bollinger'
+
+    def __str__(self):
+        return 'Bollinger bands({period}, {width}) buy low, sell high'.format(
+            period=self.period, width=self.width)
+
+
+class GridStrategyProfile(TradingStrategyProfile):
+    """Configuration for keeping a ladder of orders around the price."""
+    levels = models.PositiveSmallIntegerField(
+        default=5, help_text='orders on each side')
+    step = PercentField(help_text='distance between the orders')
+    amount = AmountField(help_text='BTC per order')
+
+    class Meta:
+        db_table = 'strategy_profile_grid'
+
+    def __str__(self):
+        return 'grid of {levels}x{amount} BTC every {step}%'.format(
+            levels=self.levels, amount=self.amount, step=self.step)
+
+    def save(self, *args, **kwargs):
+        assert self.step > 0
+        assert self.amount > 0
+        return super().save(*args, **kwargs)
+
+
 class TradingSession(models.Model):
     QUEUED, ACTIVE, FINISHED = 'queued', 'active', 'finished'
     STATUSES = [QUEUED, ACTIVE, FINISHED]
@@ -224,7 +273,10 @@ class Ticker(models.Model):
         ask: "678.57"
     }
     """
-    timestamp = models.DateTimeField()
+    timestamp = models.DateTimeField(unique=True)
+    # Timestamp of the last of the consecutive identical snapshots
+    # this row stands for, if any.
+    until = models.DateTimeField(null=True, blank=True)
     volume = AmountField()
     vwap = PriceField()
     last = PriceField()
@@ -364,6 +416,7 @@ class Transaction(models.Model):
         ordering = ['-datetime']
         get_latest_by = 'datetime'
         db_table = 'bitstamp_transaction'
+        index_together = [['account', 'datetime']]
 
     def __str__(self):
         return '${usd} | {btc} BTC'.format(usd=self.usd, btc=self.btc)
@@ -374,31 +427,72 @@ class Transaction(models.Model):
             return Transaction.SELL if self.usd > 0 else Transaction.BUY
 
     def save(self, *args, **kwargs):
-        if not self.balance_id:
+        created_balance = not self.balance_id
+        if created_balance:
             self._create_balance()
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        if created_balance:
+            # Inserted before already saved transactions; fix their balances.
+            later = self.account.transactions\
+                .filter(datetime__gte=self.datetime)\
+                .exclude(datetime=self.datetime, pk__lte=self.pk)
+            if later.exists():
+                carry_balances(
+                    later.order_by(*LEDGER_ORDER).select_related('balance'),
+                    usd_balance=self.balance.usd_balance,
+                    btc_balance=self.balance.btc_balance,
+                )
+        return result
+
+    def get_previous(self):
+        """Return the transaction preceding this one in the ledger."""
+        return self.account.transactions\
+            .filter(datetime__lte=self.datetime)\
+            .exclude(datetime=self.datetime, pk__gte=self.pk)\
+            .order_by(*('-' + field for field in LEDGER_ORDER))\
+            .select_related('balance')\
+            .first()
 
     def _create_balance(self):
+        """Carry the running totals forward from the previous transaction."""
         assert not self.balance_id
-        older = self.account.transactions.filter(datetime__lte=self.datetime)
-        aggregate = (
-            {'usd': 0, 'btc': 0, 'fee': 0}
-            if not older.exists() else
-            older.aggregate(usd=Sum('usd'), btc=Sum('btc'), fee=Sum('fee'))
-        )
-        # Reflect current transaction as well.
-        aggregate['usd'] += self.usd
-        aggregate['fee'] += self.fee
-        aggregate['btc'] += self.btc
+        previous = self.get_previous()
+        usd_balance = previous.balance.usd_balance if previous else 0
+        btc_balance = previous.balance.btc_balance if previous else 0
         self.balance = self.account.balances.create(
             inferred=True,
             timestamp=self.datetime,
-            usd_balance=aggregate['usd'] - aggregate['fee'],
-            btc_balance=aggregate['btc'],
+            usd_balance=usd_balance + self.usd - self.fee,
+            btc_balance=btc_balance + self.btc,
             fee=0,
         )
 
 
+# Order of transactions for the running balances.
+LEDGER_ORDER = ['datetime', 'pk']
+
+
+def carry_balances(transactions, usd_balance=0, btc_balance=0):
+    """
+    Recompute the inferred balances of `transactions`, which have to be
+    in `LEDGER_ORDER`, from the given opening balance.
+
+    Return the closing ``(usd_balance, btc_balance)``.
+
+    """
+    for transaction in transactions:
+        usd_balance += transaction.usd - transaction.fee
+        btc_balance += transaction.btc
+        balance = transaction.balance
+        if (balance.usd_balance, balance.btc_balance) != (usd_balance,
+                                                          btc_balance):
+            Balance.objects.filter(pk=balance.pk).update(
+                usd_balance=usd_balance,
+                btc_balance=btc_balance,
+            )
+    return usd_balance, btc_balance
+
+
 ###############################################################################
 # Signal listeners
 ###############################################################################
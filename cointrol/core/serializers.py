@@ -8,6 +8,7 @@ from cointrol.utils import json
 from .models import (
     Account, Transaction, Order, Ticker, Balance,
     TradingSession, RelativeStrategyProfile, FixedStrategyProfile,
+    EMAStrategyProfile, BollingerStrategyProfile, GridStrategyProfile,
 )
 
 
@@ -140,6 +141,50 @@ class FixedStrategyProfileSerializer(BaseStrategyProfileSerializer):
         ]
 
 
+class EMAStrategyProfileSerializer(BaseStrategyProfileSerializer):
+
+    class Meta:
+        model = EMAStrategyProfile
+        fields = [
+            'id',
+            'type_name',
+            'description',
+            'created',
+            'period',
+            'buy',
+            'sell',
+        ]
+
+
+class BollingerStrategyProfileSerializer(BaseStrategyProfileSerializer):
+
+    class Meta:
+        model = BollingerStrategyProfile
+        fields = [
+            'id',
+            'type_name',
+            'description',
+            'created',
+            'period',
+            'width',
+        ]
+
+
+class GridStrategyProfileSerializer(BaseStrategyProfileSerializer):
+
+    class Meta:
+        model = GridStrategyProfile
+        fields = [
+            'id',
+            'type_name',
+            'description',
+            'created',
+            'levels',
+            'step',
+            'amount',
+        ]
+
+
 MAPPING = {
     serializer_class.Meta.model: serializer_class
     for serializer_class in locals().values()
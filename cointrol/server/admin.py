@@ -7,6 +7,7 @@ from django.contrib import admin
 from cointrol.core.models import (
     Balance, Order, Transaction, Account, Ticker,
     TradingSession, FixedStrategyProfile, RelativeStrategyProfile,
+    EMAStrategyProfile, BollingerStrategyProfile, GridStrategyProfile,
 )
 
 
@@ -124,6 +125,38 @@ class StrategyProfileAdmin(admin.ModelAdmin):
     ]
 
 
+class EMAStrategyProfileAdmin(admin.ModelAdmin):
+
+    list_display = [
+        'created',
+        'note',
+        'period',
+        'buy',
+        'sell',
+    ]
+
+
+class BollingerStrategyProfileAdmin(admin.ModelAdmin):
+
+    list_display = [
+        'created',
+        'note',
+        'period',
+        'width',
+    ]
+
+
+class GridStrategyProfileAdmin(admin.ModelAdmin):
+
+    list_display = [
+        'created',
+        'note',
+        'levels',
+        'step',
+        'amount',
+    ]
+
+
 admin.site.register(Transaction, TransactionAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Balance, BalanceAdmin)
@@ -131,4 +164,7 @@ admin.site.register(Ticker, TickerAdmin)
 admin.site.register(TradingSession, TradingSessionAdmin)
 admin.site.register([RelativeStrategyProfile, FixedStrategyProfile],
                     StrategyProfileAdmin)
+admin.site.register(EMAStrategyProfile, EMAStrategyProfileAdmin)
+admin.site.register(BollingerStrategyProfile, BollingerStrategyProfileAdmin)
+admin.site.register(GridStrategyProfile, GridStrategyProfileAdmin)
 admin.site.register(Account)
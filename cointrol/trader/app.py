@@ -1,12 +1,13 @@
+import signal
 import logging
 
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.gen import coroutine
 from tornado import autoreload
 from django.conf import settings
 
-from .workers import (TickerWatcher, TransactionsWatcher,
-                      OrdersWatcher, Monitoring)
+from .workers import (TickerWatcher, TickerStreamer, TransactionsWatcher,
+                      OrdersWatcher, SessionWatcher, Monitoring, state, db)
 
 
 log = logging.getLogger(__name__)
@@ -18,11 +19,16 @@ def main_loop():
 
     workers = [
         Monitoring(),
-        TickerWatcher(),
+        (TickerStreamer() if settings.COINTROL_BITSTAMP_STREAM_URL
+         else TickerWatcher()),
         TransactionsWatcher(),
-        OrdersWatcher()
+        OrdersWatcher(),
+        SessionWatcher(),
     ]
 
+    PeriodicCallback(
+        lambda: db.submit(state.ticker_writer.flush_if_due), 1000).start()
+
     # First run them sequentially to avoid race conditions.
     for worker in workers:
         yield worker.run_once()
@@ -37,11 +43,17 @@ def main():
         log.info('starting Tornado autoreload')
         autoreload.start()
 
+    # Shut down cleanly, like on ^C.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
     log.info('*** main() ***')
     try:
         IOLoop.instance().run_sync(main_loop)
     except KeyboardInterrupt:
         log.info('^C, quitting')
+    finally:
+        db.shutdown()
+        state.ticker_writer.flush()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+"""
+Benchmark worker iterations against recorded Bitstamp API exchanges.
+
+Record a session by running the trader with ``COINTROL_BITSTAMP_RECORD``
+set to a file path, then replay it::
+
+    $ python -m cointrol.trader.benchmark session.jsonl.gz \\
+        TickerWatcher TransactionsWatcher OrdersWatcher -n 50 --latency 0
+
+The workers still use the configured database and Redis, so point the
+settings to scratch ones.
+
+"""
+import time
+import argparse
+import statistics
+
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+
+from . import workers
+from .nonce import NonceSequencer
+from .ratelimit import RateLimiter
+from .singleflight import SingleFlight
+from .transport import ReplayTransport
+
+
+def replay(path, latency='recorded'):
+    """Make `workers.bitstamp_client` serve recorded exchanges."""
+    client = workers.bitstamp_client
+    client.transport = ReplayTransport(path, latency=latency)
+    client.rate_limiter = RateLimiter(rate=10 ** 9, capacity=10 ** 9)
+    client.nonces = NonceSequencer()
+
+
+@coroutine
+def benchmark(worker, iterations):
+    """Return the durations of `iterations` runs of `worker.work()`."""
+    durations = []
+    for _ in range(iterations):
+        # Measure whole iterations, not reused results.
+        workers.bitstamp_client.single_flight = SingleFlight()
+        start = time.monotonic()
+        yield worker.work()
+        durations.append(time.monotonic() - start)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('recording')
+    parser.add_argument('workers', nargs='+', metavar='worker')
+    parser.add_argument('-n', '--iterations', type=int, default=20)
+    parser.add_argument('--latency', default='recorded',
+                        help='"recorded" or seconds')
+    args = parser.parse_args()
+
+    latency = args.latency
+    if latency != 'recorded':
+        latency = float(latency)
+    replay(args.recording, latency=latency)
+
+    for name in args.workers:
+        worker = getattr(workers, name)()
+        durations = IOLoop.current().run_sync(
+            lambda: benchmark(worker, args.iterations))
+        print('{: <20} n={} mean={:.4f}s median={:.4f}s max={:.4f}s'.format(
+            name, len(durations), statistics.mean(durations),
+            statistics.median(durations), max(durations)))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,9 @@ Bitstamp API client.
 <https://www.bitstamp.net/api/>
 
 The client uses `tornado.httpclient` and can be used
-either synchronous or asynchronous fashion.
+either synchronous or asynchronous (callback) fashion;
+`AsyncBitstampClient` offers an ``await`` based API. All requests
+go through a single shared `HTTPTransport`.
 
 -----
 
@@ -19,16 +21,24 @@ Based on:
 """
 from __future__ import division
 import json
-import time
 import hmac
 import hashlib
 import logging
-import datetime
+from abc import ABCMeta
 from decimal import Decimal
+from operator import itemgetter
+from collections.abc import Mapping
 from urllib.parse import urlencode
 
-import pytz
-from tornado.httpclient import AsyncHTTPClient, HTTPClient, HTTPRequest
+from tornado import gen
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+
+from . import ratelimit
+from .nonce import NonceSequencer
+from .singleflight import SingleFlight
+from .timeparse import parse_datetime, parse_timestamp
+from .transport import HTTPTransport
 
 
 log = logging.getLogger(__name__)
@@ -36,21 +46,6 @@ log = logging.getLogger(__name__)
 NOT_PROVIDED = object()
 
 
-def parse_datetime(s):
-    return datetime.datetime \
-        .strptime(s.rsplit('.', 1)[0], '%Y-%m-%d %H:%M:%S') \
-        .replace(tzinfo=pytz.timezone('Europe/London'))
-
-
-def parse_timestamp(n):
-    naive = datetime.datetime.fromtimestamp(int(n))
-    # FIXME: what timezone is it really?
-    from django.utils import timezone
-    tz = timezone.get_current_timezone()
-    local = tz.localize(naive)
-    return local
-
-
 def maybe(type_):
     """Schema field type whose value can be `None` or `type_`."""
 
@@ -61,21 +56,114 @@ def maybe(type_):
     return func
 
 
-class Model(dict):
-    schema = {}
+class Field:
+    """
+    Record field converted from the raw response value on first access.
+
+    The converted value is cached in the record's ``_<name>`` slot.
+
+    """
+    __slots__ = ('name', 'index', 'convert', 'cache')
+
+    def __init__(self, name, index, convert, cache):
+        self.name = name
+        self.index = index
+        self.convert = convert
+        self.cache = cache
+
+    def __get__(self, record, owner):
+        if record is None:
+            return self
+        try:
+            return self.cache.__get__(record, owner)
+        except AttributeError:
+            pass
+        value = record._raw[self.index]
+        if value is NOT_PROVIDED:
+            raise AttributeError(self.name)
+        if self.convert:
+            value = self.convert(value)
+        self.cache.__set__(record, value)
+        return value
+
+    def __set__(self, record, value):
+        self.cache.__set__(record, value)
+
+
+class ModelMeta(ABCMeta):
+    """Compiles a model's `schema` into slots and `Field` descriptors."""
+
+    def __new__(mcs, name, bases, namespace):
+        schema = namespace.setdefault('schema', {})
+        fields = tuple(schema)
+        namespace['__slots__'] = (tuple(namespace.get('__slots__', ()))
+                                  + tuple('_' + field for field in fields))
+        namespace['fields'] = fields
+        namespace['_known'] = frozenset(fields)
+        namespace['_getter'] = itemgetter(*fields) if len(fields) > 1 else None
+        cls = super().__new__(mcs, name, bases, namespace)
+        for index, field in enumerate(fields):
+            setattr(cls, field, Field(name=field,
+                                      index=index,
+                                      convert=schema[field],
+                                      cache=cls.__dict__['_' + field]))
+        return cls
+
+
+class Model(Mapping, metaclass=ModelMeta):
+    """
+    Read-only record decoded from an API response.
+
+    Fields are accessible both as attributes and as mapping items.
+
+    """
+    __slots__ = ('_raw',)
 
     def __init__(self, response):
-        super().__init__()
-        for key, value in response.items():
-            func = self.schema.get(key, NOT_PROVIDED)
-            if func is NOT_PROVIDED:
-                raise ValueError('%s unknown field: %r' % (type(self), key))
-            if func:
-                value = func(value)
-            self[key] = value
+        self._raw = self._decode(response)
+
+    @classmethod
+    def decode_many(cls, responses):
+        """Decode a list response into a `list` of records."""
+        decode, new = cls._decode, cls.__new__
+        records = []
+        for response in responses:
+            record = new(cls)
+            record._raw = decode(response)
+            records.append(record)
+        return records
+
+    @classmethod
+    def _decode(cls, response):
+        if len(response) == len(cls.fields) and cls._getter:
+            try:
+                # Fast path: all fields present.
+                return cls._getter(response)
+            except KeyError:
+                pass
+        if not cls._known.issuperset(response):
+            raise ValueError('%s unknown field: %r' % (
+                cls, sorted(set(response) - cls._known)[0]))
+        return tuple([response.get(field, NOT_PROVIDED)
+                      for field in cls.fields])
+
+    def __getitem__(self, key):
+        if key not in self._known:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return (field for field, raw in zip(self.fields, self._raw)
+                if raw is not NOT_PROVIDED)
 
-    def __getattr__(self, k):
-        return self[k]
+    def __len__(self):
+        return sum(raw is not NOT_PROVIDED for raw in self._raw)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self))
 
 
 class Ticker(Model):
@@ -146,23 +234,43 @@ class InvalidNonceError(BitstampClientError):
     pass
 
 
+class BitstampTimeoutError(BitstampError):
+    pass
+
+
 class BitstampClient:
     _root = 'https://www.bitstamp.net/api'
 
-    def __init__(self, username=None, key=None, secret=None):
+    # Endpoints not listed get `NORMAL` (POST) or `LOW` (GET) priority.
+    PRIORITIES = {
+        '/buy/': ratelimit.HIGH,
+        '/sell/': ratelimit.HIGH,
+        '/cancel_order/': ratelimit.HIGH,
+        '/open_orders/': ratelimit.HIGH,
+        '/ticker/': ratelimit.LOW,
+    }
+
+    # How many times to re-sign a request rejected with "Invalid nonce".
+    nonce_attempts = 3
+
+    def __init__(self, username=None, key=None, secret=None, transport=None,
+                 rate_limiter=None, nonces=None, root=None):
         credentials = [username, key, secret]
         assert all(credentials) or not any(credentials)
         self._set_auth(*credentials)
-        self._requests = []
+        if root:
+            self._root = root
+        self.transport = transport or HTTPTransport()
+        self.rate_limiter = rate_limiter or ratelimit.RateLimiter()
+        self.nonces = nonces or NonceSequencer()
 
     def _set_auth(self, username, key, secret):
         self._username = str(username)
         self._key = str(key)
         self._secret = str(secret)
-        self._nonce = int(time.time())
 
-    def _get_auth_params(self):
-        msg = str(self._nonce) + self._username + self._key
+    def _get_auth_params(self, nonce):
+        msg = str(nonce) + self._username + self._key
         signature = hmac.new(
             key=self._secret.encode('utf8'),
             msg=msg.encode('utf8'),
@@ -171,11 +279,16 @@ class BitstampClient:
         params = {
             'key': self._key,
             'signature': signature,
-            'nonce': self._nonce
+            'nonce': nonce
         }
-        self._nonce += 1
         return params
 
+    def _sign(self, params, nonce):
+        """Return the request body for `params` signed with `nonce`."""
+        params = dict(params)
+        params.update(self._get_auth_params(nonce))
+        return urlencode(params)
+
     def _get(self, path, callback=None, params=None, model_class=None):
         if params:
             path += '?' + urlencode(params)
@@ -185,42 +298,73 @@ class BitstampClient:
                              model_class=model_class)
 
     def _post(self, path, callback=None, params=None, model_class=None):
-        params = params or {}
-        params.update(self._get_auth_params())
-        body = urlencode(params)
+        # Signed when actually sent, see `_fetch()`.
         return self._request('POST',
                              path=path,
                              callback=callback,
-                             body=body,
+                             params=params or {},
                              model_class=model_class)
 
-    def _request(self, method, path, callback=None, body=None,
+    def _request(self, method, path, callback=None, params=None,
                  model_class=None):
-
-        now = datetime.datetime.utcnow()
-        period_start = now - datetime.timedelta(minutes=10)
-        self._requests = [dt for dt in self._requests if dt >= period_start]
-        self._requests.append(now)
-        log.debug('%d requests in last %d seconds',
-                  len(self._requests),
-                  (now - self._requests[0]).seconds)
-        self._requests.append(datetime.datetime.utcnow())
-        client_class = AsyncHTTPClient if callback else HTTPClient
-        log.debug('%s > %s %s %r', client_class.__name__, method, path, body)
-        request = HTTPRequest(
-            url=self._root + path,
-            method=method,
-            body=body,
-        )
-        client = client_class()
+        endpoint = path.partition('?')[0]
+        priority = self._get_priority(method, endpoint)
+        log.debug('> %s %s %r', method, path, params)
         if callback:
-            return client.fetch(
-                request=request,
-                callback=lambda resp: callback(self._process_response(
-                    resp, model_class))
+            future = self._fetch(method, path, endpoint, params, priority)
+            IOLoop.current().add_future(
+                future,
+                lambda f: callback(self._process_response(
+                    f.result(), model_class))
             )
+            return future
         else:
-            return self._process_response(client.fetch(request), model_class)
+            self.rate_limiter.acquire_sync(priority)
+            url = self._root + path
+            for attempt in range(self.nonce_attempts):
+                body = (None if params is None
+                        else self._sign(params, self.nonces.next()))
+                response = self.transport.fetch_sync(
+                    url, endpoint, method, body)
+                if not self._is_invalid_nonce(response):
+                    break
+            return self._process_response(response, model_class)
+
+    def _get_priority(self, method, endpoint):
+        return self.PRIORITIES.get(
+            endpoint, ratelimit.NORMAL if method == 'POST' else ratelimit.LOW)
+
+    @coroutine
+    def _fetch(self, method, path, endpoint, params, priority,
+               deadline=None):
+        """
+        :param deadline: `IOLoop.time()` after which the request is
+                         abandoned instead of sent
+
+        """
+        yield self.rate_limiter.acquire(priority)
+        url = self._root + path
+        if params is None:
+            self._check_deadline(deadline, path)
+            response = yield self.transport.fetch(url, endpoint, method)
+            return response
+        with (yield self.nonces.lock.acquire()):
+            self._check_deadline(deadline, path)
+            for attempt in range(1, self.nonce_attempts + 1):
+                nonce = yield self.nonces.fetch()
+                response = yield self.transport.fetch(
+                    url, endpoint, method, self._sign(params, nonce))
+                if not self._is_invalid_nonce(response):
+                    break
+                log.info('invalid nonce (attempt %d)', attempt)
+        return response
+
+    def _check_deadline(self, deadline, path):
+        if deadline is not None and IOLoop.current().time() >= deadline:
+            raise BitstampTimeoutError('%s not sent, timed out' % path)
+
+    def _is_invalid_nonce(self, response):
+        return b'Invalid nonce' in (response.body or b'')
 
     def _process_response(self, response, model_class=None):
         """
@@ -228,7 +372,6 @@ class BitstampClient:
         """
         response.rethrow()
 
-        model_class = model_class or Model
         log.debug('< %s %s', response.headers, response.body)
 
         content_type = response.headers['Content-Type']
@@ -247,13 +390,15 @@ class BitstampClient:
                 response.headers,
                 response.body) from e
 
-        if 'error' in data:
+        if isinstance(data, dict) and 'error' in data:
             if data['error'] == 'Invalid nonce':
                 raise InvalidNonceError
             raise BitstampClientError(data)
 
-        if isinstance(data, list):
-            data = list(map(model_class, data))
+        if model_class is None:
+            pass
+        elif isinstance(data, list):
+            data = model_class.decode_many(data)
         else:
             data = model_class(data)
 
@@ -432,3 +577,81 @@ class BitstampClient:
         Returns ripple deposit address as unicode string
         """
         return self._post('/ripple_address/', callback=callback)
+
+
+class AsyncBitstampClient(BitstampClient):
+    """
+    `BitstampClient` whose API methods return awaitables::
+
+        ticker = await client.ticker()
+        ticker, balance = await client.gather(
+            client.ticker(), client.account_balance())
+
+    Concurrent identical calls to the read-only endpoints in `COALESCE`
+    share a single request. Their results are reused for the number of
+    seconds given there, until a call to any other private endpoint
+    (placing or cancelling an order, etc.) invalidates them.
+
+    :param timeout: seconds after which a call fails with
+                    `BitstampTimeoutError`; a request still waiting
+                    for the rate limiter or the nonce lock by then
+                    is never sent
+
+    """
+
+    # {endpoint: seconds for which a result is reused}
+    COALESCE = {
+        '/ticker/': 1,
+        '/order_book/': 1,
+        '/transactions/': 1,
+        '/eur_usd/': 60,
+        '/balance/': 2,
+        '/open_orders/': 0,
+        '/user_transactions/': 0,
+    }
+
+    def __init__(self, *args, timeout=None, single_flight=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+        self.single_flight = single_flight or SingleFlight()
+
+    def _request(self, method, path, callback=None, params=None,
+                 model_class=None):
+        assert callback is None, 'use await instead of callbacks'
+        log.debug('> %s %s %r', method, path, params)
+        endpoint = path.partition('?')[0]
+        try:
+            ttl = self.COALESCE[endpoint]
+        except KeyError:
+            if method == 'POST':
+                self.single_flight.invalidate()
+            return self._call(method, path, params, model_class)
+        key = (method, path, tuple(sorted((params or {}).items())))
+        return self.single_flight.call(
+            key, lambda: self._call(method, path, params, model_class), ttl)
+
+    async def _call(self, method, path, params, model_class):
+        endpoint = path.partition('?')[0]
+        priority = self._get_priority(method, endpoint)
+        if self.timeout is None:
+            response = await self._fetch(
+                method, path, endpoint, params, priority)
+        else:
+            deadline = IOLoop.current().time() + self.timeout
+            try:
+                response = await gen.with_timeout(
+                    deadline,
+                    self._fetch(method, path, endpoint, params, priority,
+                                deadline=deadline),
+                    quiet_exceptions=BitstampTimeoutError,
+                )
+            except gen.TimeoutError:
+                raise BitstampTimeoutError(
+                    '%s timed out after %ss' % (path, self.timeout)
+                ) from None
+        return self._process_response(response, model_class)
+
+    @staticmethod
+    def gather(*awaitables):
+        """Run API calls concurrently; return a `list` of their results."""
+        return gen.multi(list(awaitables))
@@ -0,0 +1,127 @@
+"""
+In-process event bus for the trader.
+
+Workers publish what they observe and other workers subscribe to
+it, so that e.g. a fill is acted upon as soon as it's seen rather than
+on the next poll.
+
+"""
+import logging
+from collections import defaultdict, Counter
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, convert_yielded
+from tornado.ioloop import IOLoop
+
+
+log = logging.getLogger(__name__)
+
+
+class Event:
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
+
+
+class TickerUpdated(Event):
+    """A new ticker (`bitstamp.Ticker` or `dict`) has been seen."""
+
+    __slots__ = ('ticker',)
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+
+
+class OrderPlaced(Event):
+
+    __slots__ = ('order',)
+
+    def __init__(self, order):
+        self.order = order
+
+
+class OrderClosed(Event):
+    """Orders are no longer open on the exchange (filled or cancelled)."""
+
+    __slots__ = ('order_ids',)
+
+    def __init__(self, order_ids):
+        self.order_ids = order_ids
+
+
+class OrderFilled(Event):
+    """Transactions for an order have been saved."""
+
+    __slots__ = ('order',)
+
+    def __init__(self, order):
+        self.order = order
+
+
+class BalanceChanged(Event):
+
+    __slots__ = ('balance',)
+
+    def __init__(self, balance):
+        self.balance = balance
+
+
+class SessionActivated(Event):
+
+    __slots__ = ('session',)
+
+    def __init__(self, session):
+        self.session = session
+
+
+class EventBus:
+    """
+    Dispatches events to the handlers subscribed to their class
+    (or any of its base classes).
+
+    Handlers are called on the next `IOLoop` iteration and may return
+    a `Future` or be coroutines. Their exceptions are logged.
+
+    """
+
+    def __init__(self):
+        self.published = Counter()
+        self._handlers = defaultdict(list)
+
+    def subscribe(self, event_class, handler):
+        self._handlers[event_class].append(handler)
+
+    def unsubscribe(self, event_class, handler):
+        self._handlers[event_class].remove(handler)
+
+    def publish(self, event):
+        self.published[type(event).__name__] += 1
+        log.debug('publishing %r', event)
+        loop = IOLoop.current()
+        for event_class in type(event).__mro__:
+            for handler in self._handlers.get(event_class, ()):
+                loop.spawn_callback(self._call, handler, event)
+
+    def wait(self, event_class):
+        """Return a `Future` of the next `event_class` event."""
+        future = Future()
+
+        def handler(event):
+            self.unsubscribe(event_class, handler)
+            future.set_result(event)
+
+        self.subscribe(event_class, handler)
+        return future
+
+    @coroutine
+    def _call(self, handler, event):
+        try:
+            result = handler(event)
+            if result is not None:
+                yield convert_yielded(result)
+        except Exception:
+            log.exception('%r handler %r failed', event, handler)
@@ -0,0 +1,83 @@
+"""
+Thread pools for blocking database and Redis calls.
+
+The trader runs on a single `IOLoop`, so a slow query or Redis call made
+directly from a worker stalls all the others. `BlockingExecutor` runs
+such calls on a small pool of threads instead. Django keeps one database
+connection per thread, so each connection is only ever used by the
+thread that opened it; with ``max_workers=1`` all the database work of
+the trader is also serialized in submission order, which `AccountState`
+relies on.
+
+"""
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.gen import coroutine
+from tornado.locks import Semaphore
+
+
+log = logging.getLogger(__name__)
+
+
+class BlockingExecutor:
+    """
+    :param max_workers: number of threads
+    :param max_pending: maximum number of queued and running calls;
+                        `submit()` waits for a slot beyond that
+    :param slow: seconds of queue wait that get logged
+
+    """
+
+    def __init__(self, name, max_workers=1, max_pending=100, slow=1,
+                 clock=time.monotonic):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.slow = slow
+        self.clock = clock
+        self.pending = 0
+        self.completed = 0
+        # Queue wait times of the recent calls.
+        self.waits = deque(maxlen=1000)
+        self._slots = Semaphore(max_pending)
+        self._pool = ThreadPoolExecutor(max_workers)
+
+    @coroutine
+    def submit(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` on the pool; return its result."""
+        yield self._slots.acquire()
+        submitted = self.clock()
+        self.pending += 1
+
+        def run():
+            wait = self.clock() - submitted
+            self.waits.append(wait)
+            if wait >= self.slow:
+                log.warning('%s: %s waited %.2fs in the queue',
+                            self.name, func.__name__, wait)
+            return func(*args, **kwargs)
+
+        try:
+            result = yield self._pool.submit(run)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self._slots.release()
+        return result
+
+    def stats(self):
+        waits = sorted(self.waits)
+        return {
+            'pending': self.pending,
+            'completed': self.completed,
+            'wait_avg': sum(waits) / len(waits) if waits else 0,
+            'wait_p95': waits[int(len(waits) * .95)] if waits else 0,
+            'wait_max': waits[-1] if waits else 0,
+        }
+
+    def shutdown(self):
+        """Wait for the submitted calls to finish and stop the threads."""
+        self._pool.shutdown(wait=True)
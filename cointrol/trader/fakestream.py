@@ -0,0 +1,124 @@
+"""
+Local stand-in for the Bitstamp WebSocket feed.
+
+Speaks enough of the protocol for `cointrol.trader.stream` to be used
+and tested offline. Run it with random-walk trades::
+
+    $ python -m cointrol.trader.fakestream 8765
+
+and point ``COINTROL_BITSTAMP_STREAM_URL`` to ``ws://localhost:8765/``.
+
+"""
+import sys
+import json
+import time
+import random
+import logging
+from decimal import Decimal
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.web import Application
+from tornado.websocket import WebSocketHandler
+
+from .stream import TRADES, ORDER_BOOK
+
+
+log = logging.getLogger(__name__)
+
+
+class StreamHandler(WebSocketHandler):
+
+    def initialize(self, server):
+        self.server = server
+        self.channels = set()
+
+    def open(self):
+        self.server.connections.add(self)
+
+    def on_close(self):
+        self.server.connections.discard(self)
+
+    def on_message(self, message):
+        message = json.loads(message)
+        channel = message['data']['channel']
+        if message['event'] == 'bts:subscribe':
+            self.channels.add(channel)
+            event = 'bts:subscription_succeeded'
+        elif message['event'] == 'bts:unsubscribe':
+            self.channels.discard(channel)
+            event = 'bts:unsubscription_succeeded'
+        else:
+            return
+        self.write_message({'event': event, 'channel': channel, 'data': {}})
+
+
+class FakeStreamServer:
+
+    def __init__(self):
+        self.connections = set()
+        self.trade_ids = iter(range(1, sys.maxsize))
+        self.app = Application([
+            (r'/', StreamHandler, {'server': self}),
+        ])
+
+    def listen(self, port, address='127.0.0.1'):
+        return self.app.listen(port, address)
+
+    def broadcast(self, channel, event, data):
+        message = json.dumps({'event': event, 'channel': channel,
+                              'data': data})
+        for connection in list(self.connections):
+            if channel in connection.channels:
+                connection.write_message(message)
+
+    def publish_trade(self, price, amount, type_=0):
+        self.broadcast(TRADES, 'trade', {
+            'id': next(self.trade_ids),
+            'price': float(price),
+            'price_str': str(price),
+            'amount': float(amount),
+            'amount_str': str(amount),
+            'type': type_,
+            'timestamp': str(int(time.time())),
+        })
+
+    def publish_order_book(self, bids, asks):
+        """`bids` and `asks` are lists of ``(price, amount)``."""
+        self.broadcast(ORDER_BOOK, 'data', {
+            'timestamp': str(int(time.time())),
+            'bids': [[str(p), str(a)] for p, a in bids],
+            'asks': [[str(p), str(a)] for p, a in asks],
+        })
+
+    def request_reconnect(self):
+        for connection in list(self.connections):
+            connection.write_message({'event': 'bts:request_reconnect',
+                                      'channel': '', 'data': ''})
+
+    def drop_connections(self):
+        for connection in list(self.connections):
+            connection.close()
+
+
+def main(port=8765, interval=1):
+    logging.basicConfig(level=logging.INFO)
+    server = FakeStreamServer()
+    server.listen(port)
+    price = Decimal('500.00')
+
+    def tick():
+        nonlocal price
+        price = max(Decimal('0.01'),
+                    price + Decimal(random.randint(-100, 100)) / 100)
+        server.publish_trade(price, Decimal(random.randint(1, 10 ** 8))
+                             / 10 ** 8)
+        server.publish_order_book(bids=[(price - Decimal('0.01'), 1)],
+                                  asks=[(price + Decimal('0.01'), 1)])
+
+    PeriodicCallback(tick, interval * 1000).start()
+    log.info('listening on ws://127.0.0.1:%d/', port)
+    IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,310 @@
+"""
+Streaming market indicators.
+
+Each indicator is updated with one tick at a time in constant time, from
+running sums over a fixed-size `RingBuffer` or exponential smoothing.
+The live trader keeps them in a `Market` fed with every new ticker; the
+backtests compute them over the whole history with `BatchMarket`, which
+runs the very same update code, so both see the same values.
+
+Periods are in ticks, i.e., saved tickers.
+
+"""
+import math
+import threading
+
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed-size FIFO; `append()` returns the value it pushes out."""
+
+    __slots__ = ('size', 'values', 'start', 'count')
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [None] * size
+        self.start = 0
+        self.count = 0
+
+    def append(self, value):
+        if self.count < self.size:
+            self.values[(self.start + self.count) % self.size] = value
+            self.count += 1
+            return None
+        evicted = self.values[self.start]
+        self.values[self.start] = value
+        self.start = (self.start + 1) % self.size
+        return evicted
+
+    @property
+    def full(self):
+        return self.count == self.size
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.values[(self.start + i) % self.size]
+
+
+class Indicator:
+    """
+    Base class; `value` is `None` until enough ticks have been seen.
+
+    `OUTPUTS` are the attributes that `BatchMarket` records.
+
+    """
+
+    OUTPUTS = ('value',)
+
+    value = None
+
+    def update(self, price, volume=0):
+        raise NotImplementedError
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+
+class SMA(Indicator):
+
+    def __init__(self, period):
+        self.period = period
+        self.window = RingBuffer(period)
+        self.total = 0.0
+
+    def update(self, price, volume=0):
+        evicted = self.window.append(price)
+        self.total += price - (evicted or 0)
+        if self.window.full:
+            self.value = self.total / self.period
+
+
+class EMA(Indicator):
+    """Seeded with the SMA of the first `period` ticks."""
+
+    def __init__(self, period):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self._seed = SMA(period)
+
+    def update(self, price, volume=0):
+        if self.value is None:
+            self._seed.update(price)
+            self.value = self._seed.value
+        else:
+            self.value += self.alpha * (price - self.value)
+
+
+class VWAP(Indicator):
+    """Volume-weighted average price over the last `period` ticks."""
+
+    def __init__(self, period):
+        self.period = period
+        self.window = RingBuffer(period)
+        self.turnover = 0.0
+        self.volume = 0.0
+
+    def update(self, price, volume=0):
+        evicted = self.window.append((price * volume, volume))
+        self.turnover += price * volume
+        self.volume += volume
+        if evicted:
+            self.turnover -= evicted[0]
+            self.volume -= evicted[1]
+        if self.window.full:
+            # Without trades, fall back to the price.
+            self.value = (self.turnover / self.volume
+                          if self.volume > 1e-12 else price)
+
+
+class Bollinger(Indicator):
+    """SMA (`value`) ± `width` standard deviations."""
+
+    OUTPUTS = ('value', 'lower', 'upper')
+
+    lower = upper = None
+
+    def __init__(self, period, width=2):
+        self.period = period
+        self.width = width
+        self.window = RingBuffer(period)
+        self.total = 0.0
+        self.squares = 0.0
+
+    def update(self, price, volume=0):
+        evicted = self.window.append(price)
+        self.total += price
+        self.squares += price * price
+        if evicted is not None:
+            self.total -= evicted
+            self.squares -= evicted * evicted
+        if self.window.full:
+            mean = self.total / self.period
+            variance = max(0.0, self.squares / self.period - mean * mean)
+            deviation = self.width * math.sqrt(variance)
+            self.value = mean
+            self.lower = mean - deviation
+            self.upper = mean + deviation
+
+
+class _Wilder(Indicator):
+    """Wilder's smoothing of a per-tick quantity, seeded with its mean."""
+
+    def __init__(self, period):
+        self.period = period
+        self._previous = None
+        self._seen = 0
+        self._sums = None
+
+    def update(self, price, volume=0):
+        previous, self._previous = self._previous, price
+        if previous is None:
+            return
+        quantities = self.get_quantities(previous, price)
+        if self._sums is None:
+            self._sums = list(quantities)
+        elif self._seen < self.period:
+            self._sums = [s + q for s, q in zip(self._sums, quantities)]
+        else:
+            self._sums = [s + (q - s) / self.period
+                          for s, q in zip(self._sums, quantities)]
+        self._seen += 1
+        if self._seen == self.period:
+            self._sums = [s / self.period for s in self._sums]
+        if self._seen >= self.period:
+            self.value = self.get_value(*self._sums)
+
+    def get_quantities(self, previous, price):
+        raise NotImplementedError
+
+    def get_value(self, *averages):
+        raise NotImplementedError
+
+
+class ATR(_Wilder):
+    """
+    Average true range. With a single price per tick, the true range
+    is the absolute change of the price.
+
+    """
+
+    def get_quantities(self, previous, price):
+        return (abs(price - previous),)
+
+    def get_value(self, average):
+        return average
+
+
+class RSI(_Wilder):
+
+    def get_quantities(self, previous, price):
+        change = price - previous
+        return max(change, 0.0), max(-change, 0.0)
+
+    def get_value(self, gain, loss):
+        if not loss:
+            return 100.0 if gain else 50.0
+        return 100 - 100 / (1 + gain / loss)
+
+
+class Market:
+    """
+    Indicators of the live ticker.
+
+    Indicators are created on first use with `get()` and caught up with
+    the last `size` ticks, which are kept for that. The strategies read
+    them on the database thread while the IOLoop updates them, hence the
+    lock.
+
+    """
+
+    def __init__(self, size=1000):
+        self.history = RingBuffer(size)
+        self.indicators = {}
+        self._volume = None
+        self._lock = threading.Lock()
+
+    def update(self, last, volume=0):
+        """Add a ticker's `last` price and (24-hour) `volume`."""
+        with self._lock:
+            price, traded = float(last), self._traded(float(volume))
+            self.history.append((price, traded))
+            for indicator in self.indicators.values():
+                indicator.update(price, traded)
+
+    def _traded(self, volume):
+        previous, self._volume = self._volume, volume
+        return max(0.0, volume - previous) if previous is not None else 0.0
+
+    def get(self, indicator_class, *args):
+        key = indicator_class, args
+        with self._lock:
+            try:
+                return self.indicators[key]
+            except KeyError:
+                indicator = self.indicators[key] = indicator_class(*args)
+                for price, traded in self.history:
+                    indicator.update(price, traded)
+                return indicator
+
+
+class BatchMarket:
+    """
+    Indicators over a whole price history, read at `index`.
+
+    `get()` runs an indicator over all the ticks once, records its
+    outputs and returns a view of them at the current `index`.
+
+    """
+
+    def __init__(self, prices, volumes=None):
+        self.prices = np.asarray(prices, dtype=np.float64)
+        if volumes is None:
+            self.traded = np.zeros_like(self.prices)
+        else:
+            volumes = np.asarray(volumes, dtype=np.float64)
+            self.traded = np.zeros_like(self.prices)
+            self.traded[1:] = np.maximum(0, np.diff(volumes))
+        self.index = 0
+        self.series = {}
+
+    def get(self, indicator_class, *args):
+        key = indicator_class, args
+        if key not in self.series:
+            self.series[key] = self.run(indicator_class(*args))
+        return _SeriesView(self, self.series[key])
+
+    def run(self, indicator):
+        """Return ``{output: array}`` of `indicator` after each tick."""
+        outputs = {name: np.full(len(self.prices), np.nan)
+                   for name in indicator.OUTPUTS}
+        items = list(outputs.items())
+        for i, (price, traded) in enumerate(zip(self.prices.tolist(),
+                                                self.traded.tolist())):
+            indicator.update(price, traded)
+            if indicator.value is not None:
+                for name, array in items:
+                    array[i] = getattr(indicator, name)
+        return outputs
+
+
+class _SeriesView:
+
+    def __init__(self, market, outputs):
+        self._market = market
+        self._outputs = outputs
+
+    def __getattr__(self, name):
+        try:
+            value = self._outputs[name][self._market.index]
+        except KeyError:
+            raise AttributeError(name)
+        return None if math.isnan(value) else float(value)
+
+    @property
+    def ready(self):
+        return self.value is not None
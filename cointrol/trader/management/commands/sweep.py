@@ -0,0 +1,73 @@
+"""
+Rank strategy profile parameters by backtesting them over the ticker
+history.
+
+    $ python manage.py sweep relative --buy 97:99.5:.1 --sell 100.5:103:.1
+    $ python manage.py sweep fixed --samples 100000 \\
+        --buy 4000:6000 --sell 4500:7000
+
+"""
+import argparse
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cointrol.trader import sweep
+from cointrol.trader.backtest import Ticks
+
+
+def parse_range(value):
+    try:
+        return [Decimal(part) for part in value.split(':')]
+    except ArithmeticError:
+        raise argparse.ArgumentTypeError(
+            'invalid range: {!r}'.format(value))
+
+
+class Command(BaseCommand):
+    help = 'Backtest a grid or random sample of strategy parameters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('type', choices=sorted(sweep.PROFILE_CLASSES))
+        parser.add_argument('--buy', type=parse_range, required=True,
+                            help='START:STOP:STEP, or MIN:MAX for samples')
+        parser.add_argument('--sell', type=parse_range, required=True,
+                            help='START:STOP:STEP, or MIN:MAX for samples')
+        parser.add_argument('--samples', type=int,
+                            help='evaluate random samples instead of a grid')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--processes', type=int)
+        parser.add_argument('--usd', type=Decimal, default=Decimal(1000))
+        parser.add_argument('--fee', type=Decimal, default=Decimal('0.25'))
+        parser.add_argument('--top', type=int, default=20)
+
+    def handle(self, *args, **options):
+        buy, sell = options['buy'], options['sell']
+        if options['samples']:
+            if len(buy) != 2 or len(sell) != 2:
+                raise CommandError('samples need MIN:MAX ranges')
+            try:
+                candidates = sweep.sample(options['samples'], buy, sell,
+                                          seed=options['seed'])
+            except ValueError as e:
+                raise CommandError(e)
+        else:
+            if len(buy) != 3 or len(sell) != 3:
+                raise CommandError('a grid needs START:STOP:STEP ranges')
+            candidates = sweep.grid(sweep.decimal_range(*buy),
+                                    sweep.decimal_range(*sell))
+
+        ticks = Ticks.load()
+        if not len(ticks):
+            raise CommandError('no ticker history')
+        results = sweep.sweep(ticks, candidates,
+                              profile_type=options['type'],
+                              processes=options['processes'],
+                              usd=options['usd'], fee=options['fee'])
+
+        self.stdout.write('{: >10} {: >10} {: >6} {: >9} {: >9} {: >8}'.format(
+            'buy', 'sell', 'fills', 'return', 'drawdown', 'score'))
+        for result in results[:options['top']]:
+            self.stdout.write(
+                '{buy: >10} {sell: >10} {fills: >6} {return: >9.2%} '
+                '{max_drawdown: >9.2%} {score: >8.2f}'.format(**result))
@@ -0,0 +1,88 @@
+"""
+Nonce management for signed Bitstamp API requests.
+
+Bitstamp rejects any signed request whose nonce isn't greater than the
+last one it has seen for the API key, so nonces have to be both unique
+across all processes using the key and arrive in increasing order.
+
+"""
+import time
+import logging
+
+from tornado.gen import coroutine
+from tornado.locks import Lock
+
+
+log = logging.getLogger(__name__)
+
+
+class NonceStore:
+    """In-memory nonce counter (single process only)."""
+
+    def __init__(self):
+        self._nonce = int(time.time())
+
+    def next(self):
+        self._nonce = max(self._nonce + 1, int(time.time()))
+        return self._nonce
+
+
+class RedisNonceStore(NonceStore):
+    """
+    Nonce counter persisted in Redis.
+
+    The high-water mark survives restarts and is shared by all processes
+    using the same key. The current timestamp is used as a floor, so that
+    losing the Redis data never makes the nonce go backwards in time.
+
+    """
+
+    # INCR the key, but never return less than ARGV[1].
+    SCRIPT = """
+        local nonce = redis.call('INCR', KEYS[1])
+        local floor = tonumber(ARGV[1])
+        if nonce < floor then
+            redis.call('SET', KEYS[1], floor)
+            nonce = floor
+        end
+        return nonce
+    """
+
+    def __init__(self, redis_client, key):
+        super().__init__()
+        self.key = key
+        self._script = redis_client.register_script(self.SCRIPT)
+
+    def next(self):
+        return int(self._script(keys=[self.key], args=[int(time.time())]))
+
+
+class NonceSequencer:
+    """
+    Hands out nonces and serializes the signed requests using them.
+
+    A nonce should only be taken while holding `lock` and the lock
+    released once the response has arrived, so that concurrent private
+    requests from different workers can't overtake each other on the
+    way to Bitstamp.
+
+    :param executor: `BlockingExecutor` to take the nonces on, for stores
+                     that block (e.g., `RedisNonceStore`)
+
+    """
+
+    def __init__(self, store=None, executor=None):
+        self.store = store or NonceStore()
+        self.executor = executor
+        self.lock = Lock()
+
+    def next(self):
+        return self.store.next()
+
+    @coroutine
+    def fetch(self):
+        """Return the next nonce without blocking the `IOLoop`."""
+        if self.executor is None:
+            return self.store.next()
+        nonce = yield self.executor.submit(self.store.next)
+        return nonce
@@ -0,0 +1,139 @@
+"""
+Paper trading against the real market, without real funds.
+
+`PaperTransport` answers the account endpoints of the Bitstamp API
+(balance, orders, transactions) from a `PaperExchange` and passes the
+market data ones through to the real transport. The trader then runs
+unchanged: orders are placed with the usual client calls, and the
+resulting orders, transactions and balances are picked up by the
+watchers, saved and published like real ones.
+
+`PaperExchange` is the simulator's exchange following the real ticker
+instead of a simulated market: an open order fills at its price once
+the last trade price reaches it, as in `cointrol.trader.backtest`.
+
+The simulated account lives in memory and starts over on every restart,
+so point the settings to a scratch database.
+
+"""
+import io
+import json
+import time
+import logging
+from decimal import Decimal
+from urllib.parse import parse_qsl
+
+from django.db.models import Max
+from tornado.concurrent import Future
+from tornado.httputil import HTTPHeaders
+from tornado.httpclient import HTTPRequest, HTTPResponse
+
+from cointrol.core.models import Order, Transaction
+from . import simulator
+
+
+log = logging.getLogger(__name__)
+
+# Endpoints served by the `PaperExchange`.
+ENDPOINTS = {
+    '/balance/',
+    '/open_orders/',
+    '/user_transactions/',
+    '/buy/',
+    '/sell/',
+    '/cancel_order/',
+}
+
+
+class PaperExchange(simulator.Exchange):
+    """
+    `simulator.Exchange` following the real market with `follow()`.
+
+    There is no synthetic liquidity, so orders only ever fill at their
+    own price.
+
+    """
+
+    def follow(self, last):
+        """Fill the open orders the `last` trade price has reached."""
+        self.price = last = Decimal(last)
+        for taker_type, maker_type in [(simulator.BUY, simulator.SELL),
+                                       (simulator.SELL, simulator.BUY)]:
+            crossed = sum(
+                order.remaining for order in self.orders.values()
+                if order.type == maker_type
+                and (order.price <= last if maker_type == simulator.SELL
+                     else order.price >= last))
+            if crossed:
+                log.info('last price %s fills %s BTC', last, crossed)
+                self.submit(simulator.MARKET, taker_type, last, crossed,
+                            rest=False)
+
+
+def get_first_id():
+    """Return an ID above those of the saved orders and transactions."""
+    return 1 + max(
+        model.objects.aggregate(id=Max('pk'))['id'] or 0
+        for model in [Order, Transaction])
+
+
+class _Arguments:
+    """The parsed request body, for the simulator's API views."""
+
+    def __init__(self, body):
+        self.params = dict(parse_qsl(body or ''))
+
+    def get_argument(self, name, default=None):
+        value = self.params.get(name, default)
+        if value is None:
+            raise ValueError('Missing argument %s' % name)
+        return value
+
+    def get_decimal(self, name):
+        return Decimal(self.get_argument(name))
+
+
+class PaperTransport:
+    """
+    Transport serving the account `ENDPOINTS` from `exchange` and
+    everything else with the wrapped `transport`.
+
+    """
+
+    def __init__(self, transport, exchange):
+        self.transport = transport
+        self.exchange = exchange
+
+    @property
+    def stats(self):
+        return self.transport.stats
+
+    def fetch(self, url, path, method, body=None):
+        if path not in ENDPOINTS:
+            return self.transport.fetch(url, path, method, body)
+        future = Future()
+        future.set_result(self._respond(url, path, method, body))
+        return future
+
+    def fetch_sync(self, url, path, method, body=None):
+        if path not in ENDPOINTS:
+            return self.transport.fetch_sync(url, path, method, body)
+        return self._respond(url, path, method, body)
+
+    def _respond(self, url, path, method, body):
+        start = time.monotonic()
+        view = simulator.VIEWS[path]
+        try:
+            data = view(self.exchange, _Arguments(body))
+        except ValueError as e:
+            data = {'error': str(e)}
+        response = HTTPResponse(
+            HTTPRequest(url=url, method=method, body=body), 200,
+            headers=HTTPHeaders({'Content-Type': 'application/json'}),
+            buffer=io.BytesIO(json.dumps(data).encode('utf8')),
+        )
+        self.transport.add_stats(path, time.monotonic() - start)
+        return response
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,221 @@
+"""
+Buffered, bulk persistence for the trader.
+
+"""
+import copy
+import time
+import logging
+from itertools import groupby
+from collections import OrderedDict
+
+from django.db import connection, transaction, IntegrityError
+
+from cointrol.core.models import (
+    Balance, Order, Ticker, Transaction, LEDGER_ORDER, carry_balances)
+
+
+log = logging.getLogger(__name__)
+
+
+class TickerWriter:
+    """
+    Buffers ticker snapshots and saves them with `bulk_create()`.
+
+    Consecutive snapshots that differ only in their timestamp are stored
+    as a single row, whose `until` is the timestamp of the last of them.
+    Duplicates are rejected by the unique `timestamp` index.
+
+    :param max_size: flush once this many tickers are buffered
+    :param max_delay: flush once the oldest buffered ticker is this
+                      many seconds old
+
+    """
+
+    VALUE_FIELDS = ['last', 'high', 'low', 'vwap', 'volume',
+                    'bid', 'ask', 'open']
+
+    def __init__(self, max_size=100, max_delay=30, clock=time.monotonic):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.clock = clock
+        self.buffer = []
+        # The latest ticker, buffered or saved.
+        self.last = None
+        self.saved = 0
+        self.compressed = 0
+        self._buffered_since = None
+        self._extended = None
+
+    def add(self, **fields):
+        """
+        Buffer a snapshot; return the new (unsaved) `Ticker`, or `None`
+        if it's not newer than or identical to the last one.
+
+        """
+        last = self.last
+        timestamp = fields['timestamp']
+        if last is not None:
+            if timestamp <= (last.until or last.timestamp):
+                return None
+            if all(getattr(last, name) == fields[name]
+                   for name in self.VALUE_FIELDS):
+                last.until = timestamp
+                self.compressed += 1
+                if not (self.buffer and self.buffer[-1] is last):
+                    self._extended = last
+                return None
+        ticker = self.last = Ticker(**fields)
+        self.buffer.append(ticker)
+        if self._buffered_since is None:
+            self._buffered_since = self.clock()
+        if len(self.buffer) >= self.max_size:
+            self.flush()
+        return ticker
+
+    @property
+    def is_due(self):
+        return (self._buffered_since is not None
+                and self.clock() - self._buffered_since >= self.max_delay)
+
+    def flush_if_due(self):
+        if self.is_due:
+            self.flush()
+
+    def flush(self):
+        buffer, extended = self.buffer, self._extended
+        if not buffer and not extended:
+            return
+        with transaction.atomic():
+            if extended:
+                # Saved by an earlier flush, and we may not know its pk.
+                Ticker.objects\
+                    .filter(timestamp=extended.timestamp)\
+                    .update(until=extended.until)
+            if buffer:
+                self._insert(buffer)
+        self.buffer = []
+        self._buffered_since = None
+        self._extended = None
+        self.saved += len(buffer)
+        log.debug('flushed %d tickers', len(buffer))
+
+    def _insert(self, tickers):
+        try:
+            with transaction.atomic():
+                Ticker.objects.bulk_create(tickers)
+        except IntegrityError:
+            # Some are saved already; insert one by one, skipping those.
+            for ticker in tickers:
+                try:
+                    with transaction.atomic():
+                        ticker.save(force_insert=True)
+                except IntegrityError:
+                    log.info('ticker %s already saved', ticker.timestamp)
+
+
+# `Order` fields updated by the transactions filling it.
+ORDER_FILL_FIELDS = ['amount', 'price', 'total', 'balance', 'updated']
+
+
+def save_transactions(account, records, get_order):
+    """
+    Save a sync batch of API transaction records, sorted by id, together
+    with their inferred balances and the orders they fill, in a single
+    database transaction.
+
+    :param get_order: returns a saved `Order` by id, or raises
+                      `Order.DoesNotExist` for historical orders, which
+                      are then created
+
+    The orders returned by `get_order` are only updated once the batch
+    is committed, so that a failed batch can be retried.
+
+    Return ``(transactions, orders)``.
+
+    """
+    transactions = [Transaction(account=account, **record)
+                    for record in records]
+    orders = OrderedDict()
+    new_orders = []
+    # {order_id: Order from `get_order`}, updated through a copy.
+    saved_orders = {}
+    last_transactions = {}
+    for order_id, group in groupby(transactions, lambda t: t.order_id):
+        if not order_id:
+            continue
+        group = list(group)
+        usd = sum(t.usd for t in group)
+        btc = sum(t.btc for t in group)
+        order = orders.get(order_id)
+        if order is None:
+            try:
+                saved_orders[order_id] = get_order(order_id)
+            except Order.DoesNotExist:
+                # Most like a historical order.
+                order = Order(
+                    account=account,
+                    pk=order_id,
+                    datetime=min(t.datetime for t in group),
+                    type=Order.SELL if usd > 0 else Order.BUY,
+                    status=Order.PROCESSED,
+                )
+                new_orders.append(order)
+                log.info('order for transaction group does not exist')
+            else:
+                order = copy.copy(saved_orders[order_id])
+            orders[order_id] = order
+        order.amount += abs(btc)
+        order.price = abs(usd / order.amount)
+        order.total += abs(usd)
+        last_transactions[order_id] = group[-1]
+
+    with transaction.atomic():
+        _create_balances(account, transactions)
+        for order_id, order in orders.items():
+            order.balance = last_transactions[order_id].balance
+        Order.objects.bulk_create(new_orders)
+        for order_id in saved_orders:
+            orders[order_id].save(update_fields=ORDER_FILL_FIELDS)
+        Transaction.objects.bulk_create(transactions)
+    for order_id, order in saved_orders.items():
+        for field in ORDER_FILL_FIELDS:
+            setattr(order, field, getattr(orders[order_id], field))
+        orders[order_id] = order
+    log.debug('saved %d transactions, %d orders',
+              len(transactions), len(orders))
+    return transactions, list(orders.values())
+
+
+def _create_balances(account, transactions):
+    """Create the inferred balances of new `transactions` in bulk."""
+    ordered = sorted(transactions, key=lambda t: (t.datetime, t.pk))
+    previous = ordered[0].get_previous()
+    usd_balance = previous.balance.usd_balance if previous else 0
+    btc_balance = previous.balance.btc_balance if previous else 0
+    balances = []
+    for t in ordered:
+        usd_balance += t.usd - t.fee
+        btc_balance += t.btc
+        balances.append(Balance(
+            account=account,
+            inferred=True,
+            timestamp=t.datetime,
+            usd_balance=usd_balance,
+            btc_balance=btc_balance,
+            fee=0,
+        ))
+    if connection.features.can_return_ids_from_bulk_insert:
+        Balance.objects.bulk_create(balances)
+    else:
+        for balance in balances:
+            balance.save(force_insert=True)
+    for t, balance in zip(ordered, balances):
+        t.balance = balance
+    # Normally none, as the batch is newer than what's saved.
+    later = account.transactions.filter(datetime__gt=ordered[-1].datetime)
+    if later.exists():
+        carry_balances(
+            later.order_by(*LEDGER_ORDER).select_related('balance'),
+            usd_balance=usd_balance,
+            btc_balance=btc_balance,
+        )
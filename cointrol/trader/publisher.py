@@ -0,0 +1,117 @@
+"""
+Batched Redis publishing for the trader.
+
+Model changes and monitoring beacons are published to Redis for the web
+app. Instead of a blocking round trip per message, `RedisPublisher`
+buffers the messages produced within a short window and publishes them
+with one pipelined call on the Redis executor.
+
+"""
+import time
+import logging
+from collections import deque
+
+import redis
+from tornado import gen
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+
+
+log = logging.getLogger(__name__)
+
+
+class RedisPublisher:
+    """
+    :param redis_client: `redis.Redis`, preferably with a bounded pool
+    :param executor: `BlockingExecutor` the pipelines are executed on
+    :param window: seconds to wait for more messages before publishing
+    :param max_buffer: messages buffered at most; the oldest ones are
+                       dropped beyond that (e.g., while Redis is down)
+    :param max_batch: messages per pipeline
+    :param min_backoff: seconds before the first retry after a failure
+    :param max_backoff: maximum seconds between retries
+
+    """
+
+    def __init__(self, redis_client, executor, window=.05, max_buffer=1000,
+                 max_batch=100, min_backoff=.5, max_backoff=30,
+                 clock=time.monotonic):
+        self.redis_client = redis_client
+        self.executor = executor
+        self.window = window
+        self.max_buffer = max_buffer
+        self.max_batch = max_batch
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.buffer = deque()
+        self.published = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failures = 0
+        # Seconds between `publish()` and the pipeline's completion.
+        self.latencies = deque(maxlen=1000)
+        self._running = False
+
+    def publish(self, channel, message):
+        """Buffer `message` for publishing to `channel`."""
+        if len(self.buffer) >= self.max_buffer:
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append((self.clock(), channel, message))
+        if not self._running:
+            self._running = True
+            IOLoop.current().spawn_callback(self._run)
+
+    @coroutine
+    def _run(self):
+        backoff = self.min_backoff
+        try:
+            while self.buffer:
+                yield gen.sleep(self.window)
+                batch = [self.buffer.popleft() for _ in
+                         range(min(len(self.buffer), self.max_batch))]
+                try:
+                    yield self.executor.submit(self._execute, batch)
+                except redis.RedisError as e:
+                    self.failures += 1
+                    self._requeue(batch)
+                    log.warning('publishing %d messages failed: %s; '
+                                'retrying in %.1fs', len(batch), e, backoff)
+                    yield gen.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                else:
+                    backoff = self.min_backoff
+                    now = self.clock()
+                    self.latencies.extend(now - queued
+                                          for queued, _, _ in batch)
+                    self.published += len(batch)
+                    self.batches += 1
+        finally:
+            self._running = False
+
+    def _execute(self, batch):
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for _, channel, message in batch:
+            pipeline.publish(channel, message)
+        pipeline.execute()
+
+    def _requeue(self, batch):
+        """Put a failed batch back in front, dropping the oldest excess."""
+        self.buffer.extendleft(reversed(batch))
+        while len(self.buffer) > self.max_buffer:
+            self.buffer.popleft()
+            self.dropped += 1
+
+    def stats(self):
+        latencies = self.latencies
+        return {
+            'buffered': len(self.buffer),
+            'published': self.published,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'latency_avg': (sum(latencies) / len(latencies)
+                            if latencies else 0),
+            'latency_max': max(latencies) if latencies else 0,
+        }
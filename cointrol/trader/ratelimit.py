@@ -0,0 +1,131 @@
+"""
+Priority-aware token bucket rate limiting for the Bitstamp API.
+
+Bitstamp bans accounts making more than 600 requests per 10 minutes.
+The limiter hands out tokens in priority order, and lower priorities
+are only served while the bucket holds more than their reserve, so that
+order placement keeps working when pollers have used up most of the
+budget.
+
+"""
+import time
+import heapq
+import logging
+import itertools
+from collections import Counter
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+
+log = logging.getLogger(__name__)
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {
+    HIGH: 'high',
+    NORMAL: 'normal',
+    LOW: 'low',
+}
+
+
+class TokenBucket:
+    """
+    :param rate: tokens added per second
+    :param capacity: maximum number of tokens (the burst size)
+
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    @property
+    def tokens(self):
+        now = self.clock()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return self._tokens
+
+    def time_until(self, tokens):
+        """Return the number of seconds until `tokens` are available."""
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def take(self, tokens=1):
+        assert self.tokens >= tokens
+        self._tokens -= tokens
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all requests of a client.
+
+    The default of 0.8 requests per second with bursts of up to 100
+    stays under Bitstamp's limit (100 + 0.8 * 600 < 600) in any
+    10 minute window.
+
+    :param reserves: ``{priority: fraction of capacity}`` that has to
+                     remain in the bucket after serving the priority
+
+    """
+
+    def __init__(self, rate=0.8, capacity=100, reserves=None,
+                 clock=time.monotonic):
+        self.bucket = TokenBucket(rate=rate, capacity=capacity, clock=clock)
+        self.reserves = {HIGH: 0, NORMAL: .1, LOW: .3}
+        self.reserves.update(reserves or {})
+        self.granted = Counter()
+        self.deferred = Counter()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._timeout = None
+
+    def get_needed_tokens(self, priority):
+        return 1 + self.reserves[priority] * self.bucket.capacity
+
+    def acquire(self, priority=LOW):
+        """Return a `Future` resolved once a request can be made."""
+        future = Future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._dispatch()
+        if not future.done():
+            self.deferred[priority] += 1
+        return future
+
+    def acquire_sync(self, priority=LOW):
+        """Block until a request can be made."""
+        wait = self.bucket.time_until(self.get_needed_tokens(priority))
+        if wait:
+            self.deferred[priority] += 1
+        while wait:
+            self._log_wait(priority, wait)
+            time.sleep(wait)
+            wait = self.bucket.time_until(self.get_needed_tokens(priority))
+        self._grant(priority)
+
+    def _dispatch(self):
+        loop = IOLoop.current()
+        if self._timeout is not None:
+            loop.remove_timeout(self._timeout)
+            self._timeout = None
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            wait = self.bucket.time_until(self.get_needed_tokens(priority))
+            if wait:
+                self._log_wait(priority, wait)
+                self._timeout = loop.call_later(wait, self._dispatch)
+                break
+            heapq.heappop(self._waiters)
+            self._grant(priority)
+            future.set_result(None)
+
+    def _grant(self, priority):
+        self.bucket.take()
+        self.granted[priority] += 1
+
+    def _log_wait(self, priority, wait):
+        log.debug('deferring %s priority request by %.2fs (%.1f tokens left)',
+                  PRIORITY_NAMES[priority], wait, self.bucket.tokens)
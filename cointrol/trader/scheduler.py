@@ -0,0 +1,121 @@
+"""
+Adaptive polling intervals for the workers.
+
+Each worker has a `Schedule` whose interval drops to the minimum when the
+worker sees changes and backs off towards the maximum while it doesn't.
+The `Scheduler` shortens the intervals of order-related workers while an
+order is open, and more so when the price gets close to an order. It
+lengthens all intervals when the API rate budget runs low and adds
+jitter so that the workers don't poll in lockstep.
+
+"""
+import random
+import logging
+
+
+log = logging.getLogger(__name__)
+
+# Urgency levels.
+IDLE, ORDER_OPEN, NEAR_FILL = 0, 1, 2
+
+
+class Schedule:
+    """
+    :param interval: minimum (and initial) number of seconds between runs
+    :param max_interval: seconds between runs after backing off
+    :param urgent_intervals: ``{urgency: interval}`` caps applied while
+                             the scheduler is at that urgency or above
+    :param backoff: factor the interval grows by after an idle run
+
+    """
+
+    def __init__(self, name, interval, max_interval=None,
+                 urgent_intervals=None, backoff=1.5):
+        self.name = name
+        self.min_interval = interval
+        self.max_interval = max_interval or interval
+        self.urgent_intervals = urgent_intervals or {}
+        self.backoff = backoff
+        self.interval = interval
+        self._active = False
+
+    def active(self):
+        """Mark the current run as having seen changes."""
+        self._active = True
+
+    def done(self):
+        """Adjust the interval after a run."""
+        if self._active:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff,
+                                self.max_interval)
+        self._active = False
+
+    def __repr__(self):
+        return '<Schedule {} {:.1f}s>'.format(self.name, self.interval)
+
+
+class Scheduler:
+    """
+    :param rate_limiter: `RateLimiter` whose remaining budget is taken
+                         into account
+    :param near: relative distance of the price from an open order's
+                 price considered `NEAR_FILL`
+    :param jitter: maximum relative random deviation of the delays
+
+    """
+
+    def __init__(self, rate_limiter=None, near=0.005, jitter=0.1,
+                 random=random.random):
+        self.rate_limiter = rate_limiter
+        self.near = near
+        self.jitter = jitter
+        self.random = random
+        self.schedules = {}
+        self.order_prices = []
+        self.price = None
+
+    def register(self, name, interval, **kwargs):
+        schedule = self.schedules[name] = Schedule(name, interval, **kwargs)
+        return schedule
+
+    @property
+    def urgency(self):
+        if not self.order_prices:
+            return IDLE
+        if self.price is not None and any(
+                abs(self.price - price) <= price * self.near
+                for price in self.order_prices):
+            return NEAR_FILL
+        return ORDER_OPEN
+
+    def set_open_orders(self, prices):
+        """Set the prices of the currently open orders."""
+        prices = [float(price) for price in prices]
+        if prices != self.order_prices:
+            self.order_prices = prices
+            log.info('open order prices: %r, urgency %d',
+                     prices, self.urgency)
+
+    def set_price(self, price):
+        self.price = float(price)
+
+    def get_delay(self, schedule):
+        """Return the number of seconds to sleep before the next run."""
+        interval = schedule.interval
+        urgency = self.urgency
+        for level, urgent_interval in schedule.urgent_intervals.items():
+            if urgency >= level:
+                interval = min(interval, urgent_interval)
+        interval *= self.get_budget_factor()
+        interval *= 1 + self.jitter * (2 * self.random() - 1)
+        return interval
+
+    def get_budget_factor(self):
+        """Slow down up to 3x as less than half of the budget remains."""
+        if self.rate_limiter is None:
+            return 1
+        bucket = self.rate_limiter.bucket
+        remaining = bucket.tokens / bucket.capacity
+        return 1 + max(0, .5 - remaining) * 4
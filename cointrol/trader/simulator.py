@@ -0,0 +1,492 @@
+"""
+Simulated Bitstamp exchange for load testing without real funds.
+
+Implements the endpoints of the API that `BitstampClient` uses for
+trading on top of an in-memory, price-time priority matching engine
+(`Exchange`). In `SimulatedExchange`, the market itself is simulated by
+a random walk: on every tick, a synthetic market maker re-quotes around
+the new price and synthetic takers trade at it, filling any account
+orders they cross.
+
+Run it and point ``COINTROL_BITSTAMP_API_URL`` to it::
+
+    $ python -m cointrol.trader.simulator --port 8001
+
+or load test it with concurrent order cycles (place, fill or cancel)::
+
+    $ python -m cointrol.trader.simulator --load 20 --duration 30
+
+"""
+import json
+import time
+import heapq
+import random
+import logging
+import argparse
+import datetime
+import itertools
+import statistics
+from decimal import Decimal
+
+from tornado import gen
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.web import Application, RequestHandler
+
+from .timeparse import UTC
+
+
+log = logging.getLogger(__name__)
+
+BUY, SELL = 0, 1
+# Owner of the synthetic orders.
+MARKET = 'market'
+ACCOUNT = 'account'
+
+CENT = Decimal('0.01')
+SATOSHI = Decimal('0.00000001')
+
+
+class SimOrder:
+
+    __slots__ = ('id', 'owner', 'type', 'price', 'amount', 'remaining',
+                 'reserved', 'datetime', 'created')
+
+    def __init__(self, id, owner, type, price, amount):
+        self.id = id
+        self.owner = owner
+        self.type = type
+        self.price = price
+        self.amount = amount
+        self.remaining = amount
+        self.reserved = Decimal(0)
+        self.datetime = datetime.datetime.now(UTC)
+        self.created = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.remaining > 0
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'price': str(self.price),
+            'amount': str(self.remaining),
+            'datetime': format_datetime(self.datetime),
+        }
+
+
+class Fill:
+
+    __slots__ = ('maker', 'taker', 'price', 'amount')
+
+    def __init__(self, maker, taker, price, amount):
+        self.maker = maker
+        self.taker = taker
+        self.price = price
+        self.amount = amount
+
+
+class OrderBook:
+    """
+    Limit order book matching by price, then time.
+
+    Cancelled and filled orders are removed lazily, once they reach
+    the top of their side.
+
+    """
+
+    def __init__(self):
+        self.bids = []
+        self.asks = []
+        self._sequence = itertools.count()
+
+    def _side(self, type_):
+        return self.bids if type_ == BUY else self.asks
+
+    def _top(self, side):
+        while side and not side[0][2].is_open:
+            heapq.heappop(side)
+        if side:
+            return side[0][2]
+
+    @property
+    def best_bid(self):
+        return self._top(self.bids)
+
+    @property
+    def best_ask(self):
+        return self._top(self.asks)
+
+    def submit(self, order, rest=True):
+        """
+        Match `order` against the book; return the fills.
+
+        :param rest: add the unfilled remainder to the book, otherwise
+                     it is cancelled
+
+        """
+        fills = []
+        if order.type == BUY:
+            opposite = self.asks
+            crosses = lambda maker: maker.price <= order.price
+        else:
+            opposite = self.bids
+            crosses = lambda maker: maker.price >= order.price
+        while order.remaining:
+            maker = self._top(opposite)
+            if maker is None or not crosses(maker):
+                break
+            amount = min(order.remaining, maker.remaining)
+            maker.remaining -= amount
+            order.remaining -= amount
+            fills.append(Fill(maker, order, maker.price, amount))
+        if not rest:
+            order.remaining = Decimal(0)
+        elif order.remaining:
+            key = -order.price if order.type == BUY else order.price
+            heapq.heappush(self._side(order.type),
+                           (key, next(self._sequence), order))
+        return fills
+
+
+class Exchange:
+    """
+    Order book and a single account.
+
+    Nothing moves the market by itself: orders only trade against those
+    submitted by the account or on behalf of the `MARKET`.
+
+    :param first_id: ID of the first order or transaction
+
+    """
+
+    def __init__(self, price='500.00', usd='1000.00', btc='2.00000000',
+                 fee='0.50', first_id=1):
+        self.price = Decimal(price)
+        self.fee = Decimal(fee)
+        self.book = OrderBook()
+        self.balance = {
+            'usd': Decimal(usd),
+            'btc': Decimal(btc),
+            'usd_reserved': Decimal(0),
+            'btc_reserved': Decimal(0),
+        }
+        # Open account orders.
+        self.orders = {}
+        self.transactions = []
+        self.cycle_times = []
+        self._ids = itertools.count(first_id)
+        self.open = self.last = self.high = self.low = self.price
+        self.volume = self.turnover = Decimal(0)
+
+    # Trading.
+
+    def submit(self, owner, type_, price, amount, rest=True):
+        order = SimOrder(next(self._ids), owner, type_,
+                         price.quantize(CENT), amount.quantize(SATOSHI))
+        if owner == ACCOUNT:
+            self._reserve(order)
+            self.orders[order.id] = order
+        for fill in self.book.submit(order, rest=rest):
+            self._settle(fill)
+        if owner == ACCOUNT and not order.is_open:
+            self._close(order)
+        return order
+
+    def cancel(self, order_id):
+        order = self.orders.get(order_id)
+        if order is None:
+            return False
+        order.remaining = Decimal(0)
+        self._close(order)
+        return True
+
+    def _close(self, order):
+        """Release what's left reserved for a filled or cancelled order."""
+        if self.orders.pop(order.id, None) is None:
+            return
+        self._release(order, order.reserved)
+        self.cycle_times.append(time.monotonic() - order.created)
+
+    def _reserve(self, order):
+        if order.type == BUY:
+            needed = self._cost(order.price, order.amount)
+            currency = 'usd'
+        else:
+            needed = order.amount
+            currency = 'btc'
+        available = (self.balance[currency]
+                     - self.balance[currency + '_reserved'])
+        if needed > available:
+            raise ValueError('You have only %s %s available.'
+                             % (available, currency.upper()))
+        self.balance[currency + '_reserved'] += needed
+        order.reserved = needed
+
+    def _release(self, order, reserved):
+        currency = 'usd' if order.type == BUY else 'btc'
+        self.balance[currency + '_reserved'] -= reserved
+        order.reserved -= reserved
+
+    def _cost(self, price, amount):
+        usd = price * amount
+        return (usd + usd * self.fee / 100).quantize(CENT)
+
+    def _settle(self, fill):
+        self.last = fill.price
+        self.high = max(self.high, fill.price)
+        self.low = min(self.low, fill.price)
+        self.volume += fill.amount
+        self.turnover += fill.price * fill.amount
+        for order in (fill.maker, fill.taker):
+            if order.owner == ACCOUNT:
+                self._settle_account(order, fill)
+
+    def _settle_account(self, order, fill):
+        if order.type == BUY:
+            self._release(order, min(order.reserved,
+                                     self._cost(order.price, fill.amount)))
+        else:
+            self._release(order, fill.amount)
+        usd = (fill.price * fill.amount).quantize(CENT)
+        fee = (usd * self.fee / 100).quantize(CENT)
+        sign = 1 if order.type == BUY else -1
+        self.balance['btc'] += sign * fill.amount
+        self.balance['usd'] -= sign * usd + fee
+        self.transactions.append({
+            'id': next(self._ids),
+            'datetime': format_datetime(datetime.datetime.now(UTC)),
+            'type': 2,
+            'fee': str(fee),
+            'usd': str(-sign * usd),
+            'btc': str(sign * fill.amount),
+            'btc_usd': str(fill.price),
+            'order_id': order.id,
+        })
+        if not order.is_open:
+            self._close(order)
+
+    # API views.
+
+    def get_ticker(self):
+        vwap = self.turnover / self.volume if self.volume else self.price
+        bid, ask = self.book.best_bid, self.book.best_ask
+        return {
+            'last': str(self.last),
+            'high': str(self.high),
+            'low': str(self.low),
+            'vwap': str(vwap.quantize(CENT)),
+            'volume': str(self.volume),
+            'bid': str(bid.price if bid else self.price),
+            'ask': str(ask.price if ask else self.price),
+            'open': str(self.open),
+            'timestamp': str(int(time.time())),
+        }
+
+    def get_balance(self):
+        balance = self.balance
+        return {
+            'fee': str(self.fee),
+            'usd_balance': str(balance['usd']),
+            'btc_balance': str(balance['btc']),
+            'usd_reserved': str(balance['usd_reserved']),
+            'btc_reserved': str(balance['btc_reserved']),
+            'usd_available': str(balance['usd'] - balance['usd_reserved']),
+            'btc_available': str(balance['btc'] - balance['btc_reserved']),
+        }
+
+    def get_open_orders(self):
+        return [order.as_dict() for order in self.orders.values()
+                if order.is_open]
+
+    def get_user_transactions(self, offset=0, limit=100, sort='desc'):
+        transactions = self.transactions
+        if sort == 'desc':
+            transactions = transactions[::-1]
+        return transactions[offset:offset + limit]
+
+
+class SimulatedExchange(Exchange):
+    """
+    `Exchange` with a market simulated by a random walk, see `tick()`.
+
+    :param volatility: standard deviation of the relative price change
+                       per tick
+    :param spread: market maker's bid/ask spread in USD
+    :param depth: BTC quoted by the market maker on each side
+    :param flow: maximum BTC traded by the synthetic takers per tick
+
+    """
+
+    def __init__(self, volatility=0.001, spread='0.50', depth='5',
+                 flow='2', seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.volatility = volatility
+        self.spread = Decimal(spread)
+        self.depth = Decimal(depth)
+        self.flow = Decimal(flow)
+        self.random = random.Random(seed)
+        self._quotes = []
+        self.requote()
+
+    def tick(self):
+        """Move the price and let synthetic takers trade at it."""
+        change = Decimal(self.random.gauss(0, self.volatility))
+        self.price = max(CENT, (self.price * (1 + change)).quantize(CENT))
+        for type_ in (BUY, SELL):
+            amount = (self.flow * Decimal(self.random.random())) \
+                .quantize(SATOSHI)
+            if amount:
+                self.submit(MARKET, type_, self.price, amount, rest=False)
+        self.requote()
+
+    def requote(self):
+        for order in self._quotes:
+            order.remaining = Decimal(0)
+        half = self.spread / 2
+        self._quotes = [
+            self.submit(MARKET, BUY, self.price - half, self.depth),
+            self.submit(MARKET, SELL, self.price + half, self.depth),
+        ]
+
+
+def format_datetime(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class APIHandler(RequestHandler):
+
+    def initialize(self, exchange, view):
+        self.exchange = exchange
+        self.view = view
+
+    def get(self):
+        self.respond()
+
+    def post(self):
+        self.respond()
+
+    def check_xsrf_cookie(self):
+        pass
+
+    def respond(self):
+        try:
+            data = self.view(self.exchange, self)
+        except ValueError as e:
+            data = {'error': str(e)}
+        self.set_header('Content-Type', 'application/json')
+        # `write()` refuses top-level lists, so encode here.
+        self.finish(json.dumps(data))
+
+    def get_decimal(self, name):
+        return Decimal(self.get_argument(name))
+
+
+def _place(type_):
+    def view(exchange, handler):
+        order = exchange.submit(ACCOUNT, type_,
+                                handler.get_decimal('price'),
+                                handler.get_decimal('amount'))
+        data = order.as_dict()
+        data['amount'] = str(order.amount)
+        return data
+    return view
+
+
+VIEWS = {
+    '/ticker/': lambda exchange, handler: exchange.get_ticker(),
+    '/balance/': lambda exchange, handler: exchange.get_balance(),
+    '/open_orders/': lambda exchange, handler: exchange.get_open_orders(),
+    '/user_transactions/': lambda exchange, handler:
+        exchange.get_user_transactions(
+            offset=int(handler.get_argument('offset', 0)),
+            limit=int(handler.get_argument('limit', 100)),
+            sort=handler.get_argument('sort', 'desc'),
+        ),
+    '/buy/': _place(BUY),
+    '/sell/': _place(SELL),
+    '/cancel_order/': lambda exchange, handler:
+        exchange.cancel(int(handler.get_argument('id'))),
+}
+
+
+def make_app(exchange, prefix='/api'):
+    return Application([
+        (prefix + path, APIHandler, {'exchange': exchange, 'view': view})
+        for path, view in VIEWS.items()
+    ])
+
+
+@coroutine
+def load_test(client, exchange, rate, duration):
+    """
+    Run order cycles at `rate` per second for `duration` seconds.
+
+    Every cycle places an order near the price and cancels it if it
+    hasn't been filled after a second. Return the request latencies.
+
+    """
+    latencies = []
+
+    @coroutine
+    def cycle():
+        price = exchange.price + Decimal(random.choice([-1, 1])) / 4
+        place = random.choice([client.buy_limit_order,
+                               client.sell_limit_order])
+        start = time.monotonic()
+        order = yield place(amount=Decimal('0.01'), price=price)
+        latencies.append(time.monotonic() - start)
+        yield gen.sleep(1)
+        yield client.cancel_order(order.id)
+
+    cycles = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        cycles.append(cycle())
+        yield gen.sleep(1 / rate)
+    yield cycles
+    return latencies
+
+
+def main():
+    from .bitstamp import AsyncBitstampClient
+    from .ratelimit import RateLimiter
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--tick', type=float, default=.1,
+                        help='seconds between simulated market ticks')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--load', type=float, metavar='RATE',
+                        help='run order cycles at RATE per second')
+    parser.add_argument('--duration', type=float, default=30)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    exchange = SimulatedExchange(usd='1000000.00', btc='1000',
+                                 seed=args.seed)
+    make_app(exchange).listen(args.port, '127.0.0.1')
+    PeriodicCallback(exchange.tick, args.tick * 1000).start()
+    root = 'http://127.0.0.1:%d/api' % args.port
+    log.info('simulated exchange at %s', root)
+
+    if not args.load:
+        IOLoop.current().start()
+        return
+
+    client = AsyncBitstampClient(
+        'user', 'key', 'secret', root=root,
+        rate_limiter=RateLimiter(rate=10 ** 9, capacity=10 ** 9))
+    latencies = IOLoop.current().run_sync(
+        lambda: load_test(client, exchange, args.load, args.duration))
+    for name, values in [('request', latencies),
+                         ('order cycle', exchange.cycle_times)]:
+        print('{: <12} n={} mean={:.4f}s median={:.4f}s max={:.4f}s'.format(
+            name, len(values), statistics.mean(values),
+            statistics.median(values), max(values)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Coalescing of duplicate in-flight Bitstamp API calls.
+
+Workers often ask for the same data at about the same time (the
+balance in particular). Concurrent calls with the same key share one
+request, and its result can be reused for a short while afterwards.
+
+"""
+import time
+import logging
+
+from tornado.concurrent import Future
+from tornado.gen import convert_yielded
+
+
+log = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    :param clock: returns the current time in seconds
+
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.shared = 0
+        self.reused = 0
+        self._in_flight = {}
+        self._results = {}
+
+    def call(self, key, func, ttl=0):
+        """
+        Return a `Future` of ``func()``, shared with other calls for `key`.
+
+        :param ttl: seconds for which a successful result is reused
+
+        """
+        try:
+            expires, result = self._results[key]
+        except KeyError:
+            pass
+        else:
+            if self.clock() < expires:
+                self.reused += 1
+                log.debug('reusing result for %r', key)
+                future = Future()
+                future.set_result(result)
+                return future
+            del self._results[key]
+
+        try:
+            future = self._in_flight[key]
+        except KeyError:
+            future = self._in_flight[key] = convert_yielded(func())
+            future.add_done_callback(
+                lambda f: self._done(key, f, ttl))
+        else:
+            self.shared += 1
+            log.debug('joining in-flight call for %r', key)
+        return future
+
+    def invalidate(self):
+        """
+        Forget results, e.g., after the account state has changed.
+
+        Calls already in flight are not shared with later callers either,
+        as they might return the state from before the change.
+
+        """
+        self._results.clear()
+        self._in_flight.clear()
+
+    def _done(self, key, future, ttl):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+            if ttl and not future.exception():
+                self._results[key] = self.clock() + ttl, future.result()
@@ -0,0 +1,213 @@
+"""
+In-memory account state for the trader process.
+
+The trader process is the only writer of balances, tickers, orders and
+transactions, so it can keep the latest ones in memory instead of
+querying the database on every worker iteration. All changes go through
+`AccountState`, which writes them through to the database.
+
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from cointrol.core.models import Order, Ticker, Transaction
+from .persistence import TickerWriter
+
+
+log = logging.getLogger(__name__)
+
+
+class AccountState:
+
+    def __init__(self, account, ticker_writer=None):
+        self.account = account
+        self.ticker_writer = ticker_writer or TickerWriter()
+        # Latest balance reported by the API (i.e., not inferred).
+        self.balance = None
+        self.ticker = None
+        # {id: Order}
+        self.open_orders = {}
+        self.last_processed_order = None
+        self.latest_transaction = None
+
+    def load(self):
+        account = self.account
+        self.balance = _latest(account.balances.filter(inferred=False))
+        self.ticker = self.ticker_writer.last = _latest(Ticker.objects.all())
+        self.open_orders = {
+            order.pk: order
+            for order in account.orders.filter(status=Order.OPEN)
+        }
+        self.last_processed_order = _latest(
+            account.orders.filter(status=Order.PROCESSED))
+        self.latest_transaction = _latest(account.transactions.all())
+        log.info('loaded: balance=%s, ticker=%s, %d open orders',
+                 self.balance, self.ticker, len(self.open_orders))
+
+    def save_balance(self, **fields):
+        self.balance = self.account.balances.create(
+            inferred=False, timestamp=timezone.now(), **fields)
+        return self.balance
+
+    def save_ticker(self, **fields):
+        """
+        Buffer a ticker for saving unless it's a repeat of the current one.
+
+        Return the new, possibly not yet saved, ticker or `None`.
+
+        """
+        ticker = self.ticker_writer.add(**fields)
+        if ticker:
+            self.ticker = ticker
+        return ticker
+
+    def get_order(self, order_id):
+        """Return a saved order, preferring the in-memory instance."""
+        try:
+            return self.open_orders[order_id]
+        except KeyError:
+            return self.account.orders.get(pk=order_id)
+
+    def get_session_orders(self, open_orders, trading_session):
+        """
+        Return ``(session_orders, other_orders)``: the exchange's
+        `open_orders` saved for `trading_session`, and the rest.
+
+        """
+        session_orders, other_orders = [], []
+        for order in open_orders:
+            saved = self.open_orders.get(order.id)
+            if saved and saved.trading_session_id == trading_session.pk:
+                session_orders.append(order)
+            else:
+                other_orders.append(order)
+        return session_orders, other_orders
+
+    def reconcile_orders(self, open_orders, trading_session=None,
+                         placed=()):
+        """
+        Bring the saved orders in line with the exchange's `open_orders`.
+
+        Orders not seen before are saved as `OPEN`, with `trading_session`
+        if they are among the orders the trader has `placed` for it (and
+        without a session if not, e.g., when created manually). Open
+        orders no longer
+        on the exchange become `PROCESSED` if they have transactions, or
+        `CANCELLED` otherwise. The number of queries doesn't depend on
+        the number of orders.
+
+        Return an `OrderDelta`.
+
+        """
+        open_orders = {order.id: order for order in open_orders}
+        delta = OrderDelta()
+        with transaction.atomic():
+            unseen_ids = set(open_orders) - set(self.open_orders)
+            if unseen_ids:
+                # Orders we saved earlier and have closed since.
+                unseen_ids -= set(self.account.orders
+                                  .filter(pk__in=unseen_ids)
+                                  .values_list('pk', flat=True))
+            if unseen_ids:
+                delta.placed = self._add_open_orders(
+                    [open_orders[pk] for pk in sorted(unseen_ids)],
+                    trading_session, {order.id for order in placed})
+            closed_ids = set(self.open_orders) - set(open_orders)
+            if closed_ids:
+                delta.processed, delta.cancelled = self._close_orders(
+                    closed_ids)
+        if delta:
+            log.info('reconciled orders: %r', delta)
+        return delta
+
+    def _add_open_orders(self, records, trading_session, placed_ids):
+        orders = [
+            Order(
+                account=self.account,
+                balance=self.balance,
+                status=Order.OPEN,
+                trading_session=(trading_session
+                                 if record.id in placed_ids else None),
+                id=record.id,
+                price=record.price,
+                amount=record.amount,
+                type=record.type,
+                datetime=record.datetime,
+            )
+            for record in records
+        ]
+        Order.objects.bulk_create(orders)
+        for order in orders:
+            # `bulk_create()` only marks the orders it assigned ids to
+            # as saved.
+            order._state.adding = False
+            self.open_orders[order.pk] = order
+        return orders
+
+    def _close_orders(self, closed_ids):
+        now = timezone.now()
+        processed_ids = set(Transaction.objects
+                            .filter(order_id__in=closed_ids)
+                            .values_list('order_id', flat=True))
+        cancelled_ids = closed_ids - processed_ids
+        for status, ids in [(Order.PROCESSED, processed_ids),
+                            (Order.CANCELLED, cancelled_ids)]:
+            if ids:
+                self.account.orders.filter(pk__in=ids).update(
+                    status=status, status_changed=now)
+        processed, cancelled = [], []
+        for order_id in sorted(closed_ids):
+            order = self.open_orders.pop(order_id)
+            if order_id in processed_ids:
+                order.status = Order.PROCESSED
+                self.order_processed(order)
+                processed.append(order)
+            else:
+                order.status = Order.CANCELLED
+                cancelled.append(order)
+            order.status_changed = now
+        return processed, cancelled
+
+    def order_processed(self, order):
+        latest = self.last_processed_order
+        if latest is None or order.datetime >= latest.datetime:
+            self.last_processed_order = order
+
+    def transactions_saved(self, transactions):
+        self.latest_transaction = transactions[-1]
+
+
+class OrderDelta:
+    """Changes made by `AccountState.reconcile_orders()`."""
+
+    __slots__ = ('placed', 'processed', 'cancelled')
+
+    def __init__(self, placed=(), processed=(), cancelled=()):
+        self.placed = list(placed)
+        self.processed = list(processed)
+        self.cancelled = list(cancelled)
+
+    @property
+    def closed(self):
+        return self.processed + self.cancelled
+
+    @property
+    def changed(self):
+        return self.placed + self.closed
+
+    def __bool__(self):
+        return bool(self.placed or self.processed or self.cancelled)
+
+    def __repr__(self):
+        return '<OrderDelta placed={} processed={} cancelled={}>'.format(
+            *([order.pk for order in orders]
+              for orders in (self.placed, self.processed, self.cancelled)))
+
+
+def _latest(queryset):
+    try:
+        return queryset.latest()
+    except queryset.model.DoesNotExist:
+        return None
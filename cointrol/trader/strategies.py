@@ -2,10 +2,14 @@
 Implementation of various trading strategies.
 
 """
+from decimal import Decimal
+
 from cointrol.core.models import (
     Order, TradingSession,
-    RelativeStrategyProfile, FixedStrategyProfile
+    RelativeStrategyProfile, FixedStrategyProfile,
+    EMAStrategyProfile, BollingerStrategyProfile, GridStrategyProfile,
 )
+from . import indicators
 
 
 class TradeAction:
@@ -27,10 +31,12 @@ class BaseTradingStrategy:
 
     def __init__(self,
                  session: TradingSession,
-                 last_order: Order):
+                 last_order: Order,
+                 market: indicators.Market=None):
         self.session = session
         self.profile = session.profile
         self.last_order = last_order
+        self.market = market
 
     def get_trade_action(self) -> TradeAction:
         if self.last_order.type == Order.SELL:
@@ -69,13 +75,183 @@ class RelativeStrategy(BaseTradingStrategy):
         return self.last_order.price * (self.profile.sell / 100)
 
 
+def get_order_size(trade_action, balance, ticker):
+    """
+    Return the ``(price, amount)`` of the limit order for `trade_action`.
+
+    The price is improved to the current ask (sell) or bid (buy) if
+    that's better, and the amount leaves room for the fee.
+
+    """
+    fee_multiplier = (100 - balance.fee) / 100
+    if trade_action.action == Order.SELL:
+        amount = balance.btc_available * fee_multiplier
+        price = max(trade_action.price, ticker.ask)
+    elif trade_action.action == Order.BUY:
+        amount = ((balance.usd_available / trade_action.price)
+                  * fee_multiplier)
+        price = min(trade_action.price, ticker.bid)
+    else:
+        raise TypeError(trade_action)
+    return round(price, 2), round(amount, 8)
+
+
+class IndicatorStrategy(BaseTradingStrategy):
+    """Base class for strategies pricing orders off market indicators."""
+
+    def get_indicator(self):
+        raise NotImplementedError
+
+    def get_trade_action(self) -> TradeAction:
+        if self.market is None or not self.get_indicator().ready:
+            # Not enough ticks seen yet.
+            return None
+        return super().get_trade_action()
+
+
+class EMAStrategy(IndicatorStrategy):
+    profile = None
+    """:type: EMAStrategyProfile"""
+
+    def get_indicator(self):
+        return self.market.get(indicators.EMA, self.profile.period)
+
+    def get_buy_price(self):
+        return _price(self.get_indicator().value) * self.profile.buy / 100
+
+    def get_sell_price(self):
+        return _price(self.get_indicator().value) * self.profile.sell / 100
+
+
+class BollingerStrategy(IndicatorStrategy):
+    profile = None
+    """:type: BollingerStrategyProfile"""
+
+    def get_indicator(self):
+        return self.market.get(indicators.Bollinger, self.profile.period,
+                               float(self.profile.width))
+
+    def get_buy_price(self):
+        return _price(self.get_indicator().lower)
+
+    def get_sell_price(self):
+        return _price(self.get_indicator().upper)
+
+
+class GridPlan:
+    """Orders for `GridStrategy` to cancel and to place."""
+
+    __slots__ = ('cancel', 'place')
+
+    def __init__(self, cancel=(), place=()):
+        # Order IDs.
+        self.cancel = list(cancel)
+        # [(TradeAction, amount)]
+        self.place = list(place)
+
+    def __bool__(self):
+        return bool(self.cancel or self.place)
+
+    def __str__(self):
+        return 'cancel {}, place {}'.format(
+            self.cancel, ', '.join('{} BTC {}'.format(amount, action)
+                                   for action, amount in self.place))
+
+
+class GridStrategy:
+    """
+    Keeps `levels` buy orders below the mid price and as many sell orders
+    above it, `step` percent apart, instead of a single order at a time.
+
+    An open order stays as long as it is the one nearest to a level. The
+    others are cancelled, and the empty levels are filled nearest to the
+    price first, as far as the balance allows.
+
+    Not a `BaseTradingStrategy`: there is no single next trade action,
+    only the `GridPlan` returned by `get_plan()`.
+
+    """
+    profile = None
+    """:type: GridStrategyProfile"""
+
+    def __init__(self, session, last_order=None, market=None):
+        self.session = session
+        self.profile = session.profile
+
+    def get_plan(self, open_orders, ticker, balance, limit) -> GridPlan:
+        """
+        :param open_orders: the session's orders open on the exchange
+        :param limit: maximum number of orders to cancel and place
+
+        """
+        profile = self.profile
+        mid = (ticker.bid + ticker.ask) / 2
+        step = mid * profile.step / 100
+        positions = []
+        for order in open_orders:
+            side = -1 if order.type == Order.BUY else 1
+            position = side * (order.price - mid) / step
+            positions.append((abs(position - round(position)),
+                              round(position), order))
+        occupied = set()
+        # {(type, price)} of the orders kept and placed.
+        taken = set()
+        cancel = []
+        # Nearest to a level first.
+        for _, level, order in sorted(positions, key=lambda p: p[:2]):
+            if 1 <= level <= profile.levels and \
+                    (order.type, level) not in occupied:
+                occupied.add((order.type, level))
+                taken.add((order.type, order.price))
+            else:
+                cancel.append(order.id)
+        cancel = cancel[:limit]
+
+        place = []
+        usd, btc = balance.usd_available, balance.btc_available
+        fee_multiplier = (100 + balance.fee) / 100
+        for level in range(1, profile.levels + 1):
+            for action, side in [(Order.BUY, -1), (Order.SELL, 1)]:
+                if (action, level) in occupied:
+                    continue
+                price = mid + side * level * step
+                if action == Order.BUY:
+                    price = round(min(price, ticker.bid), 2)
+                else:
+                    price = round(max(price, ticker.ask), 2)
+                # Levels inside a spread wider than a step get clamped to
+                # the same price; one order there is enough.
+                if (action, price) in taken:
+                    continue
+                if action == Order.BUY:
+                    cost = price * profile.amount * fee_multiplier
+                    if cost > usd:
+                        continue
+                    usd -= cost
+                else:
+                    if profile.amount > btc:
+                        continue
+                    btc -= profile.amount
+                taken.add((action, price))
+                place.append((TradeAction(action, price), profile.amount))
+        return GridPlan(cancel, place[:limit - len(cancel)])
+
+
+def _price(value):
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
 # {Profile model class: implementation class}
 MAPPING = {
     FixedStrategyProfile: FixedStrategy,
     RelativeStrategyProfile: RelativeStrategy,
+    EMAStrategyProfile: EMAStrategy,
+    BollingerStrategyProfile: BollingerStrategy,
+    GridStrategyProfile: GridStrategy,
 }
 
 
-def get_for_session(session, latest_order) -> BaseTradingStrategy:
+def get_for_session(session, latest_order, market=None):
+    """Return a `BaseTradingStrategy`, or a `GridStrategy`."""
     implementation_class = MAPPING[type(session.profile)]
-    return implementation_class(session, latest_order)
+    return implementation_class(session, latest_order, market)
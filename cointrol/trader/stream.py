@@ -0,0 +1,180 @@
+"""
+Streaming Bitstamp market data.
+
+<https://www.bitstamp.net/websocket/v2/>
+
+`MarketStream` subscribes to the live trades and order book channels
+and keeps a `LiveTicker` up to date from them. The fields the feed
+doesn't carry (24h high/low/volume, etc.) are seeded from the REST
+ticker on every (re)connect and then updated from the trades.
+
+"""
+import json
+import logging
+from decimal import Decimal
+
+from tornado import gen
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+from tornado.websocket import websocket_connect
+
+from .timeparse import parse_timestamp
+
+
+log = logging.getLogger(__name__)
+
+URL = 'wss://ws.bitstamp.net'
+TRADES = 'live_trades_btcusd'
+ORDER_BOOK = 'order_book_btcusd'
+
+
+class LiveTicker:
+    """Ticker (as in `bitstamp.Ticker`) kept current by stream events."""
+
+    def __init__(self):
+        self.data = None
+        self.bids = []
+        self.asks = []
+
+    @property
+    def ready(self):
+        return self.data is not None
+
+    def reset(self, ticker):
+        """Start over from a REST API `ticker`."""
+        self.data = dict(ticker)
+
+    def on_trade(self, trade):
+        price = Decimal(trade['price_str'])
+        amount = Decimal(trade['amount_str'])
+        data = self.data
+        volume = data['volume'] + amount
+        data['vwap'] = (
+            data['vwap'] * data['volume'] + price * amount) / volume
+        data['volume'] = volume
+        data['last'] = price
+        data['high'] = max(data['high'], price)
+        data['low'] = min(data['low'], price)
+        data['timestamp'] = parse_timestamp(trade['timestamp'])
+
+    def on_order_book(self, book):
+        self.bids = book['bids']
+        self.asks = book['asks']
+        if self.bids:
+            self.data['bid'] = Decimal(self.bids[0][0])
+        if self.asks:
+            self.data['ask'] = Decimal(self.asks[0][0])
+        self.data['timestamp'] = parse_timestamp(book['timestamp'])
+
+    def snapshot(self):
+        return dict(self.data)
+
+
+class MarketStream:
+    """
+    Reconnecting WebSocket market data subscription.
+
+    :param get_ticker: returns a `Future` of the REST ticker, used to
+                       (re)sync the live ticker, e.g., ``client.ticker``
+    :param resync_interval: seconds between REST resyncs while connected
+
+    """
+
+    channels = [TRADES, ORDER_BOOK]
+
+    def __init__(self, get_ticker, url=URL, reconnect_delay=1,
+                 max_reconnect_delay=60, resync_interval=300):
+        self.get_ticker = get_ticker
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.resync_interval = resync_interval
+        self.ticker = LiveTicker()
+        self.changed = Condition()
+        self.connection = None
+        self.connects = 0
+        self.is_running = False
+        self.should_stop = False
+        self._synced = None
+
+    def start(self):
+        IOLoop.current().spawn_callback(self.run)
+
+    def stop(self):
+        self.should_stop = True
+        if self.connection is not None:
+            self.connection.close()
+
+    @coroutine
+    def run(self):
+        assert not self.is_running
+        self.is_running = True
+        self.should_stop = False
+        delay = self.reconnect_delay
+        while not self.should_stop:
+            try:
+                yield self._connect()
+                delay = self.reconnect_delay
+                yield self._read()
+            except Exception:
+                log.exception('stream failed')
+            finally:
+                self.connection = None
+            if not self.should_stop:
+                log.info('reconnecting in %ss', delay)
+                yield gen.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+        self.is_running = False
+
+    @coroutine
+    def _connect(self):
+        log.info('connecting to %s', self.url)
+        self.connection = yield websocket_connect(self.url)
+        self.connects += 1
+        for channel in self.channels:
+            self.connection.write_message(json.dumps({
+                'event': 'bts:subscribe',
+                'data': {'channel': channel},
+            }))
+        # Messages arriving meanwhile are queued by the connection.
+        yield self._resync()
+
+    @coroutine
+    def _resync(self):
+        self.ticker.reset((yield self.get_ticker()))
+        self._synced = IOLoop.current().time()
+        self._notify()
+
+    @coroutine
+    def _read(self):
+        while not self.should_stop:
+            message = yield self.connection.read_message()
+            if message is None:
+                log.info('connection closed')
+                return
+            if not self.handle(json.loads(message)):
+                return
+            if IOLoop.current().time() - self._synced > self.resync_interval:
+                yield self._resync()
+
+    def handle(self, message):
+        """Apply a stream `message`; return `False` to reconnect."""
+        event = message.get('event')
+        channel = message.get('channel')
+        if event == 'trade' and channel == TRADES:
+            self.ticker.on_trade(message['data'])
+        elif event == 'data' and channel == ORDER_BOOK:
+            self.ticker.on_order_book(message['data'])
+        elif event == 'bts:request_reconnect':
+            log.info('reconnect requested by server')
+            self.connection.close()
+            return False
+        else:
+            log.debug('ignoring %r', message)
+            return True
+        self._notify()
+        return True
+
+    def _notify(self):
+        self.changed.notify_all()
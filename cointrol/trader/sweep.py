@@ -0,0 +1,164 @@
+"""
+Parameter sweeps of strategy profiles over the ticker history.
+
+Candidate ``(buy, sell)`` thresholds, from a grid or random samples, are
+backtested in a process pool. The price arrays are copied into shared
+memory once and every worker process maps them, so the number of
+processes doesn't multiply the memory used. Results are ranked by return
+relative to the maximum drawdown.
+
+See also the ``sweep`` management command.
+
+"""
+import random
+import logging
+import multiprocessing
+from decimal import Decimal
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from cointrol.core.models import (
+    RelativeStrategyProfile, FixedStrategyProfile, EMAStrategyProfile)
+from .backtest import Ticks, backtest
+from .indicators import BatchMarket
+
+
+log = logging.getLogger(__name__)
+
+PROFILE_CLASSES = {
+    'relative': RelativeStrategyProfile,
+    'fixed': FixedStrategyProfile,
+    'ema': EMAStrategyProfile,
+}
+
+# Drawdown floor for scoring, so that the few strategies that never lose
+# aren't ranked by their (tiny) drawdown alone.
+MIN_DRAWDOWN = .01
+
+
+def grid(buy_values, sell_values):
+    """Return all ``(buy, sell)`` combinations with ``buy < sell``."""
+    return [(buy, sell)
+            for buy in buy_values
+            for sell in sell_values
+            if buy < sell]
+
+
+def sample(count, buy_range, sell_range, step=Decimal('0.01'), seed=None):
+    """
+    Return `count` random ``(buy, sell)`` pairs with ``buy < sell``.
+
+    Raise `ValueError` if the ranges don't allow any.
+
+    """
+    lowest_buy, highest_sell = (Decimal(value).quantize(step) for value
+                                in (buy_range[0], sell_range[1]))
+    if lowest_buy >= highest_sell:
+        raise ValueError('no buy value in {}:{} is below a sell value in '
+                         '{}:{}'.format(*buy_range, *sell_range))
+    rng = random.Random(seed)
+    candidates = []
+    while len(candidates) < count:
+        buy, sell = (Decimal(rng.uniform(float(low), float(high)))
+                     .quantize(step)
+                     for low, high in (buy_range, sell_range))
+        if buy < sell:
+            candidates.append((buy, sell))
+    return candidates
+
+
+def decimal_range(start, stop, step):
+    """Return the `Decimal` values from `start` to `stop` inclusive."""
+    start, stop, step = Decimal(start), Decimal(stop), Decimal(step)
+    return [start + i * step for i in range(int((stop - start) / step) + 1)]
+
+
+def score(result):
+    summary = result.summary()
+    return {
+        'fills': summary['fills'],
+        'return': summary['return'],
+        'max_drawdown': summary['max_drawdown'],
+        'score': (summary['return']
+                  / max(summary['max_drawdown'], MIN_DRAWDOWN)),
+    }
+
+
+class SharedTicks:
+    """`Ticks` arrays copied to shared memory for a process pool."""
+
+    FIELDS = Ticks.__slots__
+
+    def __init__(self, ticks):
+        self.arrays = {}
+        for name in self.FIELDS:
+            values = getattr(ticks, name)
+            array = RawArray('d', len(values))
+            np.frombuffer(array)[:] = values
+            self.arrays[name] = array
+
+    def get(self):
+        """Return `Ticks` backed by the shared memory (no copying)."""
+        return Ticks(**{name: np.frombuffer(array)
+                        for name, array in self.arrays.items()})
+
+
+# The `Ticks` of a pool worker process, and their indicators.
+_ticks = None
+_market = None
+
+
+def _init_worker(shared):
+    global _ticks, _market
+    _ticks = shared.get()
+    _market = BatchMarket(_ticks.last, _ticks.volume)
+
+
+def _evaluate(args):
+    profile_type, candidates, options = args
+    profile_class = PROFILE_CLASSES[profile_type]
+    results = []
+    for buy, sell in candidates:
+        result = backtest(profile_class(buy=buy, sell=sell), _ticks,
+                          market=_market, **options)
+        results.append(dict(score(result), buy=buy, sell=sell))
+    return results
+
+
+def sweep(ticks, candidates, profile_type='relative', processes=None,
+          chunk_size=50, **options):
+    """
+    Backtest `candidates` and return their scores, best first.
+
+    :param processes: pool size, the number of CPUs by default; 1 runs
+                      in this process
+    :param options: `backtest()` arguments (``usd``, ``fee``, ...)
+
+    """
+    chunks = [(profile_type, candidates[i:i + chunk_size], options)
+              for i in range(0, len(candidates), chunk_size)]
+    log.info('sweeping %d candidates over %d ticks',
+             len(candidates), len(ticks))
+    if processes == 1:
+        _init_worker(SharedTicks(ticks))
+        results = [result for chunk in chunks
+                   for result in _evaluate(chunk)]
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker,
+                                    (SharedTicks(ticks),))
+        try:
+            results = [result
+                       for chunk in pool.imap_unordered(_evaluate, chunks)
+                       for result in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    return rank(results)
+
+
+def rank(results):
+    # Pool results arrive in any order; ties are ranked by thresholds.
+    results = sorted(results, key=lambda r: (r['buy'], r['sell']))
+    return sorted(results, key=lambda r: (r['score'], r['return']),
+                  reverse=True)
@@ -0,0 +1,100 @@
+"""
+Incremental sync of the account's transactions.
+
+Bitstamp's ``user_transactions`` only pages by offset, newest first, and
+transaction ids only grow. The id of the latest saved transaction is the
+high-water mark: a poll asks for the newest page and is done as soon as
+the page reaches the mark, so it costs one request unless more than a
+page of transactions is new. Catching up on a longer gap (or the whole
+history on a cold start) fetches large pages, one after another: the
+requests are signed, and signed requests are sent one at a time (see
+`cointrol.trader.nonce`), so fetching pages concurrently would gain
+nothing.
+
+Transactions arriving during a scan shift the offsets, so consecutive
+pages are requested with an overlap, and the scan starts over if two of
+them don't share a transaction.
+
+"""
+import logging
+
+from tornado.gen import coroutine
+
+
+log = logging.getLogger(__name__)
+
+
+class GapError(Exception):
+    """Too many transactions arrived between two page fetches."""
+
+
+class TransactionSync:
+    """
+    :param client: `AsyncBitstampClient`
+    :param page_size: transactions per steady-state poll
+    :param backfill_page_size: transactions per catch-up page (the API
+                               maximum is 1000)
+    :param overlap: transactions shared by consecutive pages
+    :param max_attempts: scans to try before giving up on gaps
+
+    """
+
+    def __init__(self, client, page_size=100, backfill_page_size=1000,
+                 overlap=20, max_attempts=3):
+        self.client = client
+        self.page_size = page_size
+        self.backfill_page_size = backfill_page_size
+        self.overlap = overlap
+        self.max_attempts = max_attempts
+        self.requests = 0
+
+    @coroutine
+    def fetch_new(self, high_water_mark=None):
+        """
+        Return the transactions with ids above `high_water_mark`
+        (all of them if `None`), sorted by id.
+
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                transactions = yield self._scan(high_water_mark)
+            except GapError as e:
+                log.warning('%s, rescanning (attempt %d)', e, attempt)
+            else:
+                return transactions
+        raise GapError('giving up after {} attempts'.format(attempt))
+
+    @coroutine
+    def _scan(self, high_water_mark):
+        first = yield self._fetch(0, self.page_size)
+        pages = [first]
+        done = self._is_last(first, self.page_size, high_water_mark)
+        offset = self.page_size - self.overlap
+        size = self.backfill_page_size
+        while not done:
+            log.info('backfilling transactions at offset %d', offset)
+            page = yield self._fetch(offset, size)
+            self._check_overlap(pages[-1], page)
+            pages.append(page)
+            done = self._is_last(page, size, high_water_mark)
+            offset += size - self.overlap
+        transactions = {
+            transaction['id']: transaction
+            for page in pages
+            for transaction in page
+            if high_water_mark is None or transaction['id'] > high_water_mark
+        }
+        return [transactions[pk] for pk in sorted(transactions)]
+
+    def _fetch(self, offset, limit):
+        self.requests += 1
+        return self.client.user_transactions(offset=offset, limit=limit)
+
+    def _is_last(self, page, limit, high_water_mark):
+        return len(page) < limit or (
+            high_water_mark is not None
+            and page[-1]['id'] <= high_water_mark)
+
+    def _check_overlap(self, previous, page):
+        if page and not {t['id'] for t in previous} & {t['id'] for t in page}:
+            raise GapError('no overlap between transaction pages')
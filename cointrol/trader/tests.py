@@ -1,23 +1,1007 @@
-from django.db.models import Sum
-from cointrol.core.models import Transaction
-
-
-def test_balance_for_each_transaction():
-    print()
-    for t in Transaction.objects.order_by('datetime'):
-        aggregate = Transaction.objects\
-            .filter(datetime__lte=t.datetime)\
-            .aggregate(
-                usd=Sum('usd'),
-                btc=Sum('btc'),
-                fee=Sum('fee')
-        )
-        print('{id: >10} {btc: >18} {usd: >18} {fee: >18} {after_fee}'.format(
-            id=t.pk,
-            usd=aggregate['usd'],
-            btc=aggregate['btc'],
-            fee=aggregate['fee'],
-            after_fee=aggregate['usd'] - aggregate['fee'],
-        ))
-        assert aggregate['usd'] >= 0
-        assert aggregate['btc'] >= 0
+import io
+import time
+import gzip
+import json
+import datetime
+import threading
+from types import SimpleNamespace
+from decimal import Decimal
+from urllib.parse import parse_qsl
+
+import redis
+import numpy as np
+import pytest
+from django.core.management import call_command
+from django.db import connection, IntegrityError
+from django.test.utils import CaptureQueriesContext
+from tornado import gen
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+from tornado.web import Application, RequestHandler
+from cointrol.core.models import (
+    User, Balance, Order, Transaction, Ticker, RelativeStrategyProfile,
+    EMAStrategyProfile, BollingerStrategyProfile, GridStrategyProfile,
+    TradingSession, LEDGER_ORDER)
+from cointrol.trader import ratelimit, bitstamp, simulator, events, sweep
+from cointrol.trader.backtest import Ticks, backtest, find_cross
+from cointrol.trader.executor import BlockingExecutor
+from cointrol.trader.fakestream import FakeStreamServer
+from cointrol.trader.indicators import (
+    SMA, EMA, RSI, Bollinger, Market, BatchMarket)
+from cointrol.trader.nonce import NonceStore, NonceSequencer
+from cointrol.trader.paper import PaperExchange, PaperTransport
+from cointrol.trader.persistence import TickerWriter, save_transactions
+from cointrol.trader.publisher import RedisPublisher
+from cointrol.trader.ratelimit import RateLimiter
+from cointrol.trader.scheduler import Scheduler, NEAR_FILL
+from cointrol.trader.singleflight import SingleFlight
+from cointrol.trader.state import AccountState
+from cointrol.trader.strategies import GridStrategy
+from cointrol.trader.stream import MarketStream
+from cointrol.trader.sync import TransactionSync
+from cointrol.trader.timeparse import UTC, parse_datetime, parse_timestamp
+from cointrol.trader.transport import (
+    HTTPTransport, ReplayTransport, get_exchange_key)
+
+
+def test_balance_for_each_transaction(db):
+    day = datetime.datetime(2017, 11, 1, tzinfo=UTC)
+    for username, rows in [
+            ('alice', [(1, 0, '1000', '0', '0'), (3, 2, '-500', '1', '2.50'),
+                       (2, 1, '-100', '0.25', '0.50')]),
+            ('bob', [(4, 0, '200', '0', '0'), (5, 3, '-100', '0.2', '0.50'),
+                     (6, 4, '50', '-0.1', '0.25')])]:
+        account = User.objects.create(username=username).account
+        for pk, days, usd, btc, fee in rows:
+            Transaction(pk=pk, account=account,
+                        type=Transaction.MARKET_TRADE,
+                        datetime=day + datetime.timedelta(days=days),
+                        usd=Decimal(usd), btc=Decimal(btc),
+                        fee=Decimal(fee)).save()
+
+    totals = {}
+    for t in Transaction.objects.order_by(*LEDGER_ORDER):
+        usd, btc, fee = totals.get(t.account_id, (0, 0, 0))
+        usd, btc, fee = usd + t.usd, btc + t.btc, fee + t.fee
+        totals[t.account_id] = usd, btc, fee
+        assert t.balance.usd_balance == usd - fee
+        assert t.balance.btc_balance == btc
+        assert usd >= 0
+        assert btc >= 0
+    assert len(totals) == 2
+
+
+def test_ledger_carries_balances_and_fixes_out_of_order_inserts(db):
+    account = User.objects.create(username='ledger').account
+    day = datetime.datetime(2017, 11, 1, tzinfo=UTC)
+
+    def save(pk, days, usd, btc, fee=0):
+        transaction = Transaction(
+            pk=pk, account=account, type=Transaction.MARKET_TRADE,
+            datetime=day + datetime.timedelta(days=days),
+            usd=Decimal(usd), btc=Decimal(btc), fee=Decimal(fee))
+        transaction.save()
+        return transaction
+
+    def balances():
+        return [(t.balance.usd_balance, t.balance.btc_balance)
+                for t in account.transactions.order_by(*LEDGER_ORDER)]
+
+    save(1001, 0, '1000', '0')
+    save(1002, 2, '-500', '1', '1')
+    save(1004, 3, '100', '-0.2')
+    assert balances() == [(1000, 0), (499, 1), (599, Decimal('0.8'))]
+
+    # Arrives late: only the later balances change.
+    save(1003, 1, '-100', '0.25')
+    assert balances() == [(1000, 0), (900, Decimal('0.25')),
+                          (399, Decimal('1.25')), (499, Decimal('1.05'))]
+
+    Balance.objects.filter(account=account).update(usd_balance=0)
+    call_command('rebuild_balances', stdout=io.StringIO())
+    assert balances()[-1] == (499, Decimal('1.05'))
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter_serves_high_priority_within_low_reserve():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=1, capacity=10, clock=clock)
+    for _ in range(7):
+        assert limiter.acquire(ratelimit.HIGH).done()
+
+    low = limiter.acquire(ratelimit.LOW)
+    high = limiter.acquire(ratelimit.HIGH)
+    assert high.done()
+    assert not low.done()
+    assert limiter.deferred[ratelimit.LOW] == 1
+
+    clock.now += 2
+    limiter._dispatch()
+    assert low.done()
+
+
+def test_transaction_records_decode_lazily():
+    raw = {'id': 1, 'type': 2, 'fee': '0.20', 'usd': '-39.25',
+           'btc': '0.5', 'btc_usd': '78.5', 'order_id': None,
+           'datetime': '2013-03-26 18:49:13'}
+    complete, partial = bitstamp.Transaction.decode_many(
+        [raw, {'id': 2, 'type': 0}])
+    assert complete.usd == Decimal('-39.25')
+    assert complete['order_id'] is None
+    assert dict(partial) == {'id': 2, 'type': 0}
+    assert not hasattr(complete, '__dict__')
+
+
+def test_parse_datetime_fast_path_matches_strptime():
+    expected = datetime.datetime(2013, 3, 26, 18, 49, 13, tzinfo=UTC)
+    assert parse_datetime('2013-03-26 18:49:13') == expected
+    assert parse_datetime('2013-03-26 18:49:13.123456') == expected
+    assert parse_datetime.__wrapped__('2013-3-26 18:49:13') == expected
+    assert parse_timestamp('1364323753') == expected
+
+
+def test_single_flight_shares_in_flight_calls_and_reuses_results():
+    clock = FakeClock()
+    single_flight = SingleFlight(clock=clock)
+    pending = []
+
+    def func():
+        pending.append(Future())
+        return pending[-1]
+
+    first = single_flight.call('balance', func, ttl=2)
+    second = single_flight.call('balance', func, ttl=2)
+    assert first is second
+    assert len(pending) == 1
+
+    pending[0].set_result('result')
+    assert single_flight.call('balance', func, ttl=2).result() == 'result'
+    assert len(pending) == 1
+
+    clock.now += 2
+    single_flight.call('balance', func, ttl=2)
+    assert len(pending) == 2
+
+
+class FakeTransport:
+    """
+    Answers with `responses` in turn, recording the nonces of the signed
+    requests and how many requests were in flight at once.
+
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.nonces = []
+        self.in_flight = self.max_in_flight = 0
+
+    @coroutine
+    def fetch(self, url, path, method, body=None):
+        if body:
+            self.nonces.append(int(dict(parse_qsl(body))['nonce']))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        yield gen.sleep(.01)
+        self.in_flight -= 1
+        data = self.responses.pop(0) if self.responses else True
+        return HTTPResponse(
+            HTTPRequest(url=url, method=method, body=body), 200,
+            headers=HTTPHeaders({'Content-Type': 'application/json'}),
+            buffer=io.BytesIO(json.dumps(data).encode('utf8')))
+
+
+class ThreadRecordingNonceStore(NonceStore):
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def next(self):
+        self.threads.add(threading.current_thread())
+        return super().next()
+
+
+def test_nonce_sequencer_orders_concurrent_signed_requests():
+    store = ThreadRecordingNonceStore()
+    transport = FakeTransport()
+    client = bitstamp.AsyncBitstampClient(
+        'user', 'key', 'secret', transport=transport,
+        rate_limiter=RateLimiter(rate=10 ** 9, capacity=10 ** 9),
+        nonces=NonceSequencer(store, executor=BlockingExecutor('redis')))
+
+    results = IOLoop.current().run_sync(lambda: client.gather(
+        *[client.cancel_order(order_id) for order_id in range(5)]))
+    assert results == [True] * 5
+    assert transport.nonces == sorted(set(transport.nonces))
+    assert len(transport.nonces) == 5
+    # One signed request at a time, nonces taken off the IOLoop thread.
+    assert transport.max_in_flight == 1
+    assert threading.main_thread() not in store.threads
+
+
+def test_invalid_nonce_is_re_signed_and_retried():
+    invalid = {'error': 'Invalid nonce'}
+    transport = FakeTransport(invalid, True)
+    client = bitstamp.AsyncBitstampClient(
+        'user', 'key', 'secret', transport=transport,
+        rate_limiter=RateLimiter(rate=10 ** 9, capacity=10 ** 9))
+
+    assert IOLoop.current().run_sync(lambda: client.cancel_order(1))
+    first, second = transport.nonces
+    assert second > first
+
+    transport = client.transport = FakeTransport(
+        *[invalid] * client.nonce_attempts)
+    with pytest.raises(bitstamp.InvalidNonceError):
+        IOLoop.current().run_sync(lambda: client.cancel_order(1))
+    assert len(transport.nonces) == client.nonce_attempts
+
+
+def test_call_past_its_deadline_in_the_rate_limiter_is_never_sent():
+    limiter = RateLimiter(rate=10, capacity=1)
+    assert limiter.acquire(ratelimit.HIGH).done()
+    transport = FakeTransport()
+    client = bitstamp.AsyncBitstampClient(
+        'user', 'key', 'secret', transport=transport, rate_limiter=limiter,
+        timeout=.02)
+
+    @coroutine
+    def cancel():
+        with pytest.raises(bitstamp.BitstampTimeoutError):
+            yield client.cancel_order(1)
+        # Let the limiter grant the token the call was waiting for.
+        yield gen.sleep(.15)
+
+    IOLoop.current().run_sync(cancel)
+    assert limiter.granted[ratelimit.HIGH] == 2
+    assert transport.nonces == []
+
+
+def test_gather_runs_calls_concurrently():
+    transport = FakeTransport({}, {}, {})
+    client = bitstamp.AsyncBitstampClient(
+        transport=transport,
+        rate_limiter=RateLimiter(rate=10 ** 9, capacity=10 ** 9))
+
+    results = IOLoop.current().run_sync(lambda: client.gather(
+        client.order_book(), client.order_book(group=False),
+        client.conversion_rate_usd_eur()))
+    assert results == [{}, {}, {}]
+    assert transport.max_in_flight == 3
+
+
+def test_market_stream_updates_live_ticker_from_fake_feed():
+    server = FakeStreamServer()
+    sock, port = bind_unused_port()
+    HTTPServer(server.app).add_socket(sock)
+    rest_ticker = {
+        'vwap': Decimal('500'), 'last': Decimal('500'),
+        'high': Decimal('510'), 'low': Decimal('490'),
+        'bid': Decimal('499'), 'ask': Decimal('501'),
+        'volume': Decimal('10'), 'open': Decimal('495'),
+        'timestamp': parse_timestamp(0),
+    }
+
+    @coroutine
+    def get_ticker():
+        return rest_ticker
+
+    stream = MarketStream(get_ticker, url='ws://127.0.0.1:%d/' % port)
+
+    @coroutine
+    def run():
+        stream.start()
+        while not stream.ticker.ready or not server.connections:
+            yield gen.sleep(.01)
+        # Let the subscriptions arrive.
+        yield gen.sleep(.1)
+        server.publish_trade(Decimal('520'), Decimal('10'))
+        server.publish_order_book(bids=[(519, 1)], asks=[(521, 1)])
+        while stream.ticker.data['ask'] != 521:
+            yield stream.changed.wait()
+        stream.stop()
+
+    IOLoop.current().run_sync(run, timeout=5)
+    ticker = stream.ticker.snapshot()
+    assert ticker['last'] == ticker['high'] == 520
+    assert ticker['volume'] == 20
+    assert ticker['vwap'] == 510
+    assert ticker['bid'] == 519
+
+
+def test_market_stream_reconnects_and_resyncs_from_rest_ticker():
+    server = FakeStreamServer()
+    sock, port = bind_unused_port()
+    HTTPServer(server.app).add_socket(sock)
+    rest_ticker = {
+        'vwap': Decimal('500'), 'last': Decimal('500'),
+        'high': Decimal('510'), 'low': Decimal('490'),
+        'bid': Decimal('499'), 'ask': Decimal('501'),
+        'volume': Decimal('10'), 'open': Decimal('495'),
+        'timestamp': parse_timestamp(0),
+    }
+
+    @coroutine
+    def get_ticker():
+        return rest_ticker
+
+    stream = MarketStream(get_ticker, url='ws://127.0.0.1:%d/' % port,
+                          reconnect_delay=.01)
+
+    @coroutine
+    def wait_for(condition):
+        while not condition():
+            yield gen.sleep(.01)
+
+    def subscribed():
+        connections = list(server.connections)
+        return (len(connections) == 1
+                and len(connections[0].channels) == len(stream.channels))
+
+    @coroutine
+    def run():
+        stream.start()
+        yield wait_for(subscribed)
+        server.publish_trade(Decimal('520'), Decimal('10'))
+        yield wait_for(lambda: stream.ticker.data['last'] == 520)
+
+        rest_ticker.update(last=Decimal('530'), high=Decimal('530'))
+        server.request_reconnect()
+        yield wait_for(lambda: stream.connects == 2 and subscribed()
+                       and stream.ticker.data['last'] == 530)
+        requested = stream.ticker.snapshot()
+
+        rest_ticker.update(last=Decimal('540'), high=Decimal('540'))
+        server.drop_connections()
+        yield wait_for(lambda: stream.connects == 3 and subscribed()
+                       and stream.ticker.data['last'] == 540)
+        dropped = stream.ticker.snapshot()
+
+        server.publish_trade(Decimal('545'), Decimal('10'))
+        yield wait_for(lambda: stream.ticker.data['last'] == 545)
+        stream.stop()
+        return requested, dropped
+
+    requested, dropped = IOLoop.current().run_sync(run, timeout=5)
+    # The streamed trade is dropped in favour of the REST ticker.
+    assert (requested['last'], requested['volume']) == (530, 10)
+    assert (dropped['last'], dropped['volume']) == (540, 10)
+    assert stream.ticker.data['volume'] == 20
+
+
+class SlowHandler(RequestHandler):
+
+    @coroutine
+    def get(self, seconds):
+        yield gen.sleep(float(seconds))
+        self.write({'slept': seconds})
+
+
+def test_http_transport_applies_path_timeouts_and_counts_requests():
+    sock, port = bind_unused_port()
+    HTTPServer(Application([(r'/sleep/(.*)', SlowHandler)])).add_socket(sock)
+    transport = HTTPTransport(request_timeout=5, timeouts={'/slow/': .05})
+    root = 'http://127.0.0.1:%d/sleep/' % port
+
+    @coroutine
+    def run():
+        responses = yield [
+            transport.fetch(root + '0', '/fast/', 'GET'),
+            transport.fetch(root + '0', '/fast/', 'GET'),
+            transport.fetch(root + '.5', '/slow/', 'GET'),
+        ]
+        return responses
+
+    fast, _, slow = IOLoop.current().run_sync(run, timeout=5)
+    transport.close()
+    assert fast.code == 200 and json.loads(fast.body) == {'slept': '0'}
+    # Timed out by the per-path timeout, not the default one.
+    assert slow.code == 599 and slow.request_time < 1
+    stats = transport.stats
+    assert (stats['/fast/'].requests, stats['/fast/'].errors) == (2, 0)
+    assert (stats['/slow/'].requests, stats['/slow/'].errors) == (1, 1)
+    assert stats['/slow/'].max_time < 1
+
+
+def test_replay_transport_serves_recorded_exchanges_in_order(tmpdir):
+    path = str(tmpdir.join('session.jsonl.gz'))
+    url = bitstamp.BitstampClient._root + '/open_orders/'
+    key = get_exchange_key('POST', url, 'nonce=1&signature=X&key=K')
+    with gzip.open(path, 'wt') as f:
+        for body in ['[]', '[{"id": 1}]']:
+            f.write(json.dumps({'key': key, 'code': 200, 'time': 0.5,
+                                'content_type': 'application/json',
+                                'body': body}) + '\n')
+
+    client = bitstamp.BitstampClient(
+        'user', 'key', 'secret', transport=ReplayTransport(path, latency=0))
+    assert client.open_orders() == []
+    assert client.open_orders()[0].id == 1
+    assert client.open_orders()[0].id == 1
+
+
+def test_simulator_matches_by_price_then_time():
+    exchange = simulator.SimulatedExchange(price='500.00', spread='10',
+                                           seed=1)
+    first = exchange.submit(simulator.ACCOUNT, simulator.SELL,
+                            Decimal('501'), Decimal('0.5'))
+    second = exchange.submit(simulator.ACCOUNT, simulator.SELL,
+                             Decimal('501'), Decimal('0.5'))
+    better = exchange.submit(simulator.ACCOUNT, simulator.SELL,
+                             Decimal('502'), Decimal('0.5'))
+    exchange.submit(simulator.MARKET, simulator.BUY,
+                    Decimal('502'), Decimal('0.7'), rest=False)
+    assert not first.is_open
+    assert second.remaining == Decimal('0.3')
+    assert better.is_open
+    assert exchange.get_balance()['btc_reserved'] == '0.80000000'
+    assert [t['order_id'] for t in exchange.transactions] == [
+        first.id, second.id]
+
+
+def test_paper_trading_fills_orders_at_the_live_price(tmpdir):
+    path = str(tmpdir.join('session.jsonl.gz'))
+    url = bitstamp.BitstampClient._root + '/ticker/'
+    ticker = {'last': '500.00', 'bid': '499.90', 'ask': '500.10',
+              'volume': '10.00000000', 'timestamp': '1500000000'}
+    with gzip.open(path, 'wt') as f:
+        f.write(json.dumps({'key': get_exchange_key('GET', url), 'code': 200,
+                            'time': 0, 'content_type': 'application/json',
+                            'body': json.dumps(ticker)}) + '\n')
+    exchange = PaperExchange(usd='1000.00', btc='0', fee='0.5',
+                             first_id=100)
+    client = bitstamp.AsyncBitstampClient(
+        'user', 'key', 'secret',
+        transport=PaperTransport(ReplayTransport(path, latency=0), exchange),
+        rate_limiter=RateLimiter(rate=10 ** 9, capacity=10 ** 9))
+
+    @coroutine
+    def trade():
+        ticker = yield client.ticker()
+        order = yield client.buy_limit_order(amount=Decimal(1),
+                                             price=Decimal('490.00'))
+        with pytest.raises(bitstamp.BitstampClientError):
+            yield client.buy_limit_order(amount=Decimal(2),
+                                         price=Decimal('490.00'))
+        exchange.follow(ticker.last)
+        still_open = yield client.open_orders()
+        exchange.follow('489.50')
+        orders, transactions, balance = yield client.gather(
+            client.open_orders(), client.user_transactions(),
+            client.account_balance())
+        return order, still_open, orders, transactions, balance
+
+    order, still_open, orders, transactions, balance = \
+        IOLoop.current().run_sync(trade)
+    assert order.id == 100
+    assert [o.id for o in still_open] == [order.id]
+    assert orders == []
+    [transaction] = transactions
+    assert transaction.id > order.id
+    assert transaction.order_id == order.id
+    assert transaction.btc_usd == Decimal('490.00')
+    assert (transaction.usd, transaction.fee) == (Decimal(-490),
+                                                  Decimal('2.45'))
+    assert balance.usd_available == Decimal('507.55')
+    assert balance.btc_balance == 1
+    # Answered by the paper exchange, but counted like real requests.
+    assert client.transport.stats['/buy/'].requests == 2
+
+
+def test_scheduler_backs_off_when_idle_and_polls_near_fills():
+    scheduler = Scheduler(jitter=0, near=0.01)
+    schedule = scheduler.register('orders', interval=5, max_interval=30,
+                                  urgent_intervals={NEAR_FILL: 2})
+    for _ in range(10):
+        schedule.done()
+    assert scheduler.get_delay(schedule) == 30
+
+    scheduler.set_open_orders([Decimal('500')])
+    scheduler.set_price(Decimal('503'))
+    assert scheduler.get_delay(schedule) == 2
+
+    schedule.active()
+    schedule.done()
+    scheduler.set_open_orders([])
+    assert scheduler.get_delay(schedule) == 5
+
+
+def test_event_bus_dispatches_to_base_class_subscribers():
+    bus = events.EventBus()
+    seen = []
+    bus.subscribe(events.Event, seen.append)
+
+    @coroutine
+    def run():
+        filled = bus.wait(events.OrderFilled)
+        bus.publish(events.TickerUpdated({'last': 1}))
+        bus.publish(events.OrderFilled('order'))
+        event = yield filled
+        return event
+
+    event = IOLoop.current().run_sync(run, timeout=1)
+    assert event.order == 'order'
+    assert [type(e) for e in seen] == [events.TickerUpdated,
+                                       events.OrderFilled]
+
+
+def test_ticker_writer_compresses_repeats_and_flushes_in_bulk(db):
+    clock = FakeClock()
+    writer = TickerWriter(max_size=10, max_delay=5, clock=clock)
+    values = dict(last=500, high=510, low=490, vwap=500, volume=10,
+                  bid=499, ask=501, open=495)
+    start = Ticker.objects.count()
+
+    assert writer.add(timestamp=parse_timestamp(1), **values)
+    assert not writer.add(timestamp=parse_timestamp(2), **values)
+    assert not writer.add(timestamp=parse_timestamp(1), **values)
+    assert not writer.is_due
+    clock.now += 5
+    writer.flush_if_due()
+    assert Ticker.objects.count() == start + 1
+
+    assert not writer.add(timestamp=parse_timestamp(3), **values)
+    assert writer.add(timestamp=parse_timestamp(4), **dict(values, last=501))
+    writer.flush()
+    assert Ticker.objects.count() == start + 2
+    assert Ticker.objects.get(
+        timestamp=parse_timestamp(1)).until == parse_timestamp(3)
+
+
+class FakeTransactionsClient:
+
+    def __init__(self, count, arriving=0):
+        self.transactions = [{'id': pk} for pk in range(1, count + 1)]
+        self.arriving = arriving
+
+    @coroutine
+    def user_transactions(self, offset, limit):
+        yield gen.moment
+        page = self.transactions[::-1][offset:offset + limit]
+        # Transactions made while the request was in flight.
+        last = self.transactions[-1]['id']
+        self.transactions.extend({'id': last + i + 1}
+                                 for i in range(self.arriving))
+        return page
+
+
+def test_transaction_sync_polls_once_and_backfills_in_large_pages():
+    client = FakeTransactionsClient(2500)
+    sync = TransactionSync(client)
+    run = IOLoop.current().run_sync
+
+    new = run(lambda: sync.fetch_new(high_water_mark=2450), timeout=1)
+    assert [t['id'] for t in new] == list(range(2451, 2501))
+    assert sync.requests == 1
+
+    sync.requests = 0
+    new = run(lambda: sync.fetch_new(), timeout=1)
+    assert [t['id'] for t in new] == list(range(1, 2501))
+    # The first page and three overlapping catch-up pages.
+    assert sync.requests == 1 + 3
+
+    # Pages overlap, so transactions arriving mid-scan leave no gaps.
+    client.arriving = 5
+    new = run(lambda: sync.fetch_new(high_water_mark=100), timeout=1)
+    ids = [t['id'] for t in new]
+    assert ids == list(range(101, ids[-1] + 1))
+
+
+def test_save_transactions_writes_batch_atomically(db):
+    account = User.objects.create(username='batch').account
+    open_order = account.orders.create(
+        pk=501, status=Order.OPEN, type=Order.BUY, price=500, amount=0,
+        datetime=datetime.datetime(2017, 11, 1, tzinfo=UTC))
+    records = bitstamp.Transaction.decode_many([
+        {'id': 11, 'datetime': '2017-11-02 10:00:00', 'type': 2,
+         'fee': '0', 'usd': '1000', 'btc': '0', 'btc_usd': '0',
+         'order_id': None},
+        {'id': 12, 'datetime': '2017-11-02 11:00:00', 'type': 2,
+         'fee': '0.5', 'usd': '-250', 'btc': '0.5', 'btc_usd': '500',
+         'order_id': 501},
+        {'id': 13, 'datetime': '2017-11-02 11:00:01', 'type': 2,
+         'fee': '0.5', 'usd': '-250', 'btc': '0.5', 'btc_usd': '500',
+         'order_id': 501},
+        {'id': 14, 'datetime': '2017-11-02 12:00:00', 'type': 2,
+         'fee': '0', 'usd': '100', 'btc': '-0.2', 'btc_usd': '500',
+         'order_id': 502},
+    ])
+    # As with `AccountState.get_order`, open orders are live instances.
+    open_orders = {open_order.pk: open_order}
+
+    def get_order(pk):
+        try:
+            return open_orders[pk]
+        except KeyError:
+            return account.orders.get(pk=pk)
+
+    transactions, orders = save_transactions(account, records, get_order)
+
+    assert [o.pk for o in orders] == [501, 502]
+    assert orders[0] is open_order
+    assert account.orders.get(pk=502).type == Order.SELL
+    assert open_order.amount == 1
+    assert open_order.balance.usd_balance == 499
+    saved = account.orders.get(pk=501)
+    assert (saved.amount, saved.total) == (1, 500)
+    assert saved.balance == open_order.balance
+    assert [(t.balance.usd_balance, t.balance.btc_balance)
+            for t in account.transactions.order_by(*LEDGER_ORDER)] == [
+        (1000, 0), (749.5, Decimal('0.5')), (499, 1), (599, Decimal('0.8'))]
+
+    # A failing batch leaves nothing behind.
+    balance_count = account.balances.count()
+    with pytest.raises(IntegrityError):
+        save_transactions(account, records, get_order)
+    assert account.balances.count() == balance_count
+    # Neither in the database nor in memory.
+    assert (open_order.amount, open_order.total) == (1, 500)
+    open_order.refresh_from_db()
+    assert open_order.amount == 1
+
+
+def test_reconcile_orders_uses_constant_queries(db):
+    account = User.objects.create(username='reconcile').account
+    state = AccountState(account)
+    state.load()
+    now = datetime.datetime(2017, 11, 1, tzinfo=UTC)
+
+    def records(ids):
+        return [SimpleNamespace(id=pk, price=500 + pk, amount=1,
+                                type=Order.BUY, datetime=now)
+                for pk in ids]
+
+    with CaptureQueriesContext(connection) as ladder:
+        delta = state.reconcile_orders(records(range(1, 51)))
+    assert [o.pk for o in delta.placed] == list(range(1, 51))
+    assert account.orders.filter(status=Order.OPEN).count() == 50
+
+    filled = account.orders.get(pk=7)
+    save_transactions(account, bitstamp.Transaction.decode_many([
+        {'id': 701, 'datetime': '2017-11-02 10:00:00', 'type': 2,
+         'fee': '0', 'usd': '-507', 'btc': '1', 'btc_usd': '507',
+         'order_id': 7}]), state.get_order)
+    filled.refresh_from_db()
+    assert filled.total == 507
+    assert filled.balance.usd_balance == -507
+    assert not state.get_order(7)._state.adding
+    with CaptureQueriesContext(connection) as changes:
+        delta = state.reconcile_orders(records([*range(8, 51), 51]))
+    assert [o.pk for o in delta.placed] == [51]
+    assert [o.pk for o in delta.processed] == [filled.pk]
+    assert [o.pk for o in delta.cancelled] == list(range(1, 7))
+    # Independent of the number of orders.
+    assert len(_statements(ladder)) <= 4
+    assert len(_statements(changes)) <= 6
+    assert account.orders.filter(status=Order.OPEN).count() == 44
+    assert not state.reconcile_orders(records([*range(8, 51), 51]))
+
+
+def test_account_state_loads_saved_orders_and_closes_them(db):
+    account = User.objects.create(username='state').account
+    day = datetime.datetime(2017, 11, 1, tzinfo=UTC)
+    hour = datetime.timedelta(hours=1)
+    balance = account.balances.create(timestamp=day, fee=Decimal('0.25'),
+                                      usd_balance=1000)
+    account.balances.create(timestamp=day + hour, fee=Decimal('0.25'),
+                            inferred=True)
+
+    def order(pk, status, hours=0):
+        return account.orders.create(
+            id=pk, status=status, price=500, amount=1, type=Order.BUY,
+            datetime=day + hours * hour, balance=balance)
+
+    order(1, Order.PROCESSED, hours=-2)
+    order(2, Order.CANCELLED)
+    for pk in [3, 4, 5]:
+        order(pk, Order.OPEN, hours=pk)
+    account.transactions.create(
+        id=401, order_id=4, balance=balance, datetime=day + 5 * hour,
+        type=Transaction.MARKET_TRADE, btc=1, usd=-500, btc_usd=500)
+
+    state = AccountState(account)
+    state.load()
+    assert state.balance == balance
+    assert sorted(state.open_orders) == [3, 4, 5]
+    assert state.last_processed_order.pk == 1
+    assert state.latest_transaction.pk == 401
+
+    def records(ids):
+        return [SimpleNamespace(id=pk, price=500, amount=1, type=Order.BUY,
+                                datetime=day + pk * hour)
+                for pk in ids]
+
+    # Known open orders are diffed in memory; closed ones aren't reopened.
+    with CaptureQueriesContext(connection) as unchanged:
+        assert not state.reconcile_orders(records([3, 4, 5]))
+    assert not _statements(unchanged)
+    assert not state.reconcile_orders(records([1, 2, 3, 4, 5]))
+    assert account.orders.filter(status=Order.OPEN).count() == 3
+
+    # Gone from the exchange: filled if it has transactions.
+    delta = state.reconcile_orders(records([5]))
+    assert [o.pk for o in delta.processed] == [4]
+    assert [o.pk for o in delta.cancelled] == [3]
+    assert sorted(state.open_orders) == [5]
+    assert state.last_processed_order.pk == 4
+    saved = dict(account.orders.values_list('pk', 'status'))
+    assert saved == {1: Order.PROCESSED, 2: Order.CANCELLED,
+                     3: Order.CANCELLED, 4: Order.PROCESSED, 5: Order.OPEN}
+    for closed in delta.closed:
+        assert closed.status == saved[closed.pk]
+        assert closed.status_changed is not None
+
+
+def _statements(context):
+    """Captured queries, without the savepoints of the test's transaction."""
+    return [query for query in context.captured_queries
+            if 'SAVEPOINT' not in query['sql']]
+
+
+def test_blocking_executor_keeps_the_loop_responsive():
+    executor = BlockingExecutor('test', max_workers=1, max_pending=2)
+    threads = set()
+    ticks = []
+
+    def block(seconds):
+        threads.add(threading.get_ident())
+        time.sleep(seconds)
+        return seconds
+
+    @coroutine
+    def run():
+        calls = [executor.submit(block, .05) for _ in range(3)]
+        while not all(call.done() for call in calls):
+            ticks.append(executor.pending)
+            yield gen.sleep(.01)
+        return (yield calls)
+
+    assert IOLoop.current().run_sync(run, timeout=2) == [.05] * 3
+    assert len(ticks) >= 10
+    assert max(ticks) == 2
+    assert len(threads) == 1 and threading.get_ident() not in threads
+    stats = executor.stats()
+    assert stats['completed'] == 3
+    assert .04 < stats['wait_max'] < .2
+    executor.shutdown()
+
+
+class FakeRedis:
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.executed = []
+
+    def pipeline(self, transaction=True):
+        redis_client = self
+        commands = []
+
+        class Pipeline:
+            def publish(self, channel, message):
+                commands.append((channel, message))
+
+            def execute(self):
+                if redis_client.failures:
+                    redis_client.failures -= 1
+                    raise redis.ConnectionError('connection refused')
+                redis_client.executed.append(commands)
+
+        return Pipeline()
+
+
+def test_redis_publisher_batches_and_retries():
+    redis_client = FakeRedis(failures=1)
+    executor = BlockingExecutor('redis')
+    publisher = RedisPublisher(redis_client, executor, window=.01,
+                               max_buffer=5, max_batch=3, min_backoff=.01)
+
+    @coroutine
+    def run():
+        for i in range(7):
+            publisher.publish('model_changes', str(i))
+        while publisher.buffer or publisher._running:
+            yield gen.sleep(.01)
+
+    IOLoop.current().run_sync(run, timeout=2)
+    # The two oldest didn't fit in the buffer; the first batch was retried.
+    assert redis_client.executed == [
+        [('model_changes', '2'), ('model_changes', '3'),
+         ('model_changes', '4')],
+        [('model_changes', '5'), ('model_changes', '6')],
+    ]
+    stats = publisher.stats()
+    assert (stats['published'], stats['batches'], stats['dropped'],
+            stats['failures']) == (5, 2, 2, 1)
+    executor.shutdown()
+
+
+def test_backtest_alternates_orders_and_charges_fees():
+    last = np.array([500, 495, 489, 495, 505, 512, 520, 509, 489], float)
+    ticks = Ticks(np.arange(len(last)) * 3, last, last - 1, last + 1)
+    profile = RelativeStrategyProfile(buy=Decimal('98'), sell=Decimal('102'))
+
+    result = backtest(profile, ticks, usd=1000, fee=Decimal('0.5'))
+
+    # Buy at 490 (98% of 500), sell at 499.80, buy at 489.80.
+    assert [(f.index, f.type, f.price) for f in result.fills] == [
+        (2, Order.BUY, Decimal('490.00')),
+        (4, Order.SELL, Decimal('499.80')),
+        (8, Order.BUY, Decimal('489.80')),
+    ]
+    buy = result.fills[0]
+    assert buy.amount == Decimal('2.03061224')
+    assert buy.fee == Decimal('4.98')
+    assert result.btc == sum(f.amount if f.type == Order.BUY else -f.amount
+                             for f in result.fills)
+    assert result.equity[0] == 1000
+    assert 0 < result.max_drawdown < .05
+    assert find_cross(last, 0, 480, below=True) is None
+    assert find_cross(last, 5, 510, below=False, chunk=1) == 5
+
+
+def test_streaming_and_batch_indicators_agree():
+    last = 500 + 20 * np.sin(np.arange(300) / 10)
+    volume = np.arange(300) * 2.0
+    market, batch = Market(size=len(last)), BatchMarket(last, volume)
+    for price, cumulative in zip(last, volume):
+        market.update(Decimal(price).quantize(Decimal('0.00000001')),
+                      cumulative)
+    batch.index = len(last) - 1
+    for args in [(SMA, 20), (EMA, 20), (RSI, 14), (Bollinger, 20, 2.0)]:
+        assert (market.get(*args).value
+                == pytest.approx(batch.get(*args).value))
+    sma = SMA(3)
+    for price in [1, 2, 3, 4]:
+        sma.update(price)
+    assert sma.value == 3
+    rsi = RSI(2)
+    for price in [10, 11, 12, 11]:
+        rsi.update(price)
+    # Seeded gains 1, 1 and losses 0, 0; then a loss of 1.
+    assert rsi.value == pytest.approx(100 - 100 / (1 + .5 / .5))
+    bands = batch.get(Bollinger, 20, 2.0)
+    assert bands.lower < bands.value < bands.upper
+    batch.index = 10
+    assert not bands.ready
+
+
+def test_indicator_strategies_wait_for_enough_ticks():
+    last = 500 + 20 * np.sin(np.arange(2000) / 50)
+    ticks = Ticks(np.arange(len(last)) * 3, last, last - .5, last + .5)
+
+    profile = BollingerStrategyProfile(period=50, width=Decimal(1))
+    result = backtest(profile, ticks)
+    assert result.fills and result.fills[0].index >= 50
+    assert [f.type for f in result.fills[:2]] == [Order.BUY, Order.SELL]
+
+    profile = EMAStrategyProfile(period=20, buy=Decimal(99),
+                                 sell=Decimal(101))
+    assert backtest(profile, ticks).fills
+
+
+def test_grid_strategy_keeps_levels_and_replaces_strays():
+    profile = GridStrategyProfile(levels=3, step=Decimal(1),
+                                  amount=Decimal('0.1'))
+    strategy = GridStrategy(SimpleNamespace(profile=profile), None)
+    ticker = SimpleNamespace(bid=Decimal('499.50'), ask=Decimal('500.50'))
+    balance = SimpleNamespace(usd_available=Decimal(100), fee=Decimal(1),
+                              btc_available=Decimal('0.15'))
+    open_orders = [
+        SimpleNamespace(id=1, type=Order.BUY, price=Decimal('495.20')),
+        # Same level as #1.
+        SimpleNamespace(id=2, type=Order.BUY, price=Decimal('494.50')),
+        # Beyond the last level.
+        SimpleNamespace(id=3, type=Order.BUY, price=Decimal('470.00')),
+        SimpleNamespace(id=4, type=Order.SELL, price=Decimal('509.90')),
+    ]
+
+    plan = strategy.get_plan(open_orders, ticker, balance, limit=10)
+
+    assert sorted(plan.cancel) == [2, 3]
+    # Nearest first; one sell and two buys are all the balance allows.
+    assert [(action.action, action.price, amount)
+            for action, amount in plan.place] == [
+        (Order.SELL, Decimal('505.00'), Decimal('0.1')),
+        (Order.BUY, Decimal('490.00'), Decimal('0.1')),
+        (Order.BUY, Decimal('485.00'), Decimal('0.1')),
+    ]
+    plan = strategy.get_plan(open_orders, ticker, balance, limit=3)
+    assert (len(plan.cancel), len(plan.place)) == (2, 1)
+
+
+def test_grid_strategy_skips_levels_clamped_to_a_taken_price():
+    # A spread of four steps: the first levels fall inside it.
+    profile = GridStrategyProfile(levels=3, step=Decimal('0.1'),
+                                  amount=Decimal('0.1'))
+    strategy = GridStrategy(SimpleNamespace(profile=profile), None)
+    ticker = SimpleNamespace(bid=Decimal('499'), ask=Decimal('501'))
+    balance = SimpleNamespace(usd_available=Decimal(1000), fee=Decimal(1),
+                              btc_available=Decimal(1))
+
+    plan = strategy.get_plan([], ticker, balance, limit=10)
+
+    placed = [(action.action, action.price) for action, _ in plan.place]
+    assert sorted(placed) == [
+        (Order.BUY, Decimal('498.50')), (Order.BUY, Decimal('499.00')),
+        (Order.SELL, Decimal('501.00')), (Order.SELL, Decimal('501.50')),
+    ]
+    # Once placed, the orders are left alone.
+    open_orders = [SimpleNamespace(id=pk, type=type_, price=price)
+                   for pk, (type_, price) in enumerate(placed, 1)]
+    assert not strategy.get_plan(open_orders, ticker, balance, limit=10)
+
+
+def test_grid_session_leaves_manual_orders_alone(db):
+    account = User.objects.create(username='grid').account
+    profile = GridStrategyProfile.objects.create(
+        account=account, levels=3, step=Decimal(1), amount=Decimal('0.1'))
+    session = TradingSession.objects.create(
+        account=account, strategy_profile=profile,
+        status=TradingSession.ACTIVE)
+    state = AccountState(account)
+    state.load()
+    now = datetime.datetime(2017, 11, 1, tzinfo=UTC)
+    grid_order = SimpleNamespace(id=1, type=Order.BUY, price=Decimal(495),
+                                 amount=Decimal('0.1'), datetime=now)
+    # Created manually while the grid was being placed, beyond its levels.
+    manual_order = SimpleNamespace(id=2, type=Order.BUY, price=Decimal(470),
+                                   amount=Decimal(1), datetime=now)
+    open_orders = [grid_order, manual_order]
+
+    state.reconcile_orders(open_orders, trading_session=session,
+                           placed=[grid_order])
+
+    assert dict(account.orders.values_list('pk', 'trading_session')) == {
+        1: session.pk, 2: None}
+    session_orders, other_orders = state.get_session_orders(open_orders,
+                                                            session)
+    assert (session_orders, other_orders) == ([grid_order], [manual_order])
+    ticker = SimpleNamespace(bid=Decimal('499.50'), ask=Decimal('500.50'))
+    balance = SimpleNamespace(usd_available=Decimal(1000), fee=Decimal(1),
+                              btc_available=Decimal(1))
+    strategy = GridStrategy(session, None)
+    assert strategy.get_plan(open_orders, ticker, balance,
+                             limit=10).cancel == [manual_order.id]
+    assert strategy.get_plan(session_orders, ticker, balance,
+                             limit=10).cancel == []
+
+
+def test_backtest_rejects_grid_profiles():
+    last = np.array([500, 495, 505], float)
+    ticks = Ticks(np.arange(len(last)) * 3, last, last - 1, last + 1)
+    profile = GridStrategyProfile(levels=3, step=Decimal(1),
+                                  amount=Decimal('0.1'))
+    with pytest.raises(ValueError):
+        backtest(profile, ticks)
+
+
+def test_sweep_ranks_candidates_in_a_process_pool():
+    last = 500 + 20 * np.sin(np.arange(2000) / 50)
+    ticks = Ticks(np.arange(len(last)) * 3, last, last - .5, last + .5)
+    candidates = sweep.grid(sweep.decimal_range(96, 99, 1),
+                            sweep.decimal_range(101, 104, 1))
+    assert len(candidates) == 16
+    assert len(sweep.sample(10, (96, 99), (101, 104), seed=1)) == 10
+    with pytest.raises(ValueError):
+        sweep.sample(3, (101, 103), (99, 100))
+
+    results = sweep.sweep(ticks, candidates, processes=2, chunk_size=3)
+    assert results == sweep.sweep(ticks, candidates, processes=1)
+    assert len(results) == 16
+    scores = [result['score'] for result in results]
+    assert scores == sorted(scores, reverse=True)
+    # Swings of 8% can't fill thresholds 8% apart or more.
+    assert results[-1]['fills'] <= 1 < results[0]['fills']
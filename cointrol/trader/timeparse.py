@@ -0,0 +1,76 @@
+"""
+Datetime decoding for Bitstamp payloads.
+
+Bitstamp reports ``datetime`` fields as ``YYYY-MM-DD HH:MM:SS[.ffffff]``
+strings and ticker ``timestamp`` as Unix time, both in UTC. Values are
+decoded into aware `datetime.datetime` objects with a shared UTC tzinfo.
+
+Run ``python -m cointrol.trader.timeparse`` for a micro-benchmark against
+the previous `strptime`/`pytz` based parsers.
+
+"""
+import datetime
+from functools import lru_cache
+
+
+UTC = datetime.timezone.utc
+
+# Enough for the repeated values on a transaction page or in ticker polls.
+CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_datetime(s):
+    """Decode a Bitstamp ``datetime`` string, ignoring any fraction."""
+    if len(s) >= 19 and s[4] == '-' and s[10] == ' ':
+        # Fast path: fixed-width format, slice the components.
+        try:
+            return datetime.datetime(
+                int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                int(s[11:13]), int(s[14:16]), int(s[17:19]),
+                tzinfo=UTC)
+        except ValueError:
+            pass
+    return datetime.datetime \
+        .strptime(s.rsplit('.', 1)[0], '%Y-%m-%d %H:%M:%S') \
+        .replace(tzinfo=UTC)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_timestamp(n):
+    """Decode a Unix ``timestamp`` (`int` or numeric `str`)."""
+    return datetime.datetime.fromtimestamp(int(n), UTC)
+
+
+def _benchmark(number=100000):
+    import timeit
+    import pytz
+
+    def legacy_parse_datetime(s):
+        return datetime.datetime \
+            .strptime(s.rsplit('.', 1)[0], '%Y-%m-%d %H:%M:%S') \
+            .replace(tzinfo=pytz.timezone('Europe/London'))
+
+    def legacy_parse_timestamp(n):
+        naive = datetime.datetime.fromtimestamp(int(n))
+        return pytz.timezone('Europe/Copenhagen').localize(naive)
+
+    # Distinct values, so that the cache doesn't flatter the new parsers.
+    datetimes = ['2014-01-%02d %02d:%02d:%02d.123456' % (
+        1 + i % 28, i % 24, i % 60, i * 7 % 60) for i in range(number)]
+    timestamps = [str(1388534400 + i * 61) for i in range(number)]
+
+    for name, legacy, current, values in [
+        ('parse_datetime', legacy_parse_datetime,
+         parse_datetime.__wrapped__, datetimes),
+        ('parse_timestamp', legacy_parse_timestamp,
+         parse_timestamp.__wrapped__, timestamps),
+    ]:
+        before = timeit.timeit(lambda: list(map(legacy, values)), number=1)
+        after = timeit.timeit(lambda: list(map(current, values)), number=1)
+        print('{: <16} legacy {:.3f}s  now {:.3f}s  ({:.1f}x)'.format(
+            name, before, after, before / after))
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,299 @@
+"""
+HTTP transports for the Bitstamp API client.
+
+A transport owns the underlying `tornado.httpclient` clients so that
+they (and their connections) are reused across requests instead of
+being created for every call.
+
+`RecordingTransport` and `ReplayTransport` record exchanges with the
+API to a file and serve them back, so that the trader can be run and
+benchmarked offline.
+
+"""
+import io
+import time
+import gzip
+import json
+import logging
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl
+
+from tornado.concurrent import Future
+from tornado.httputil import HTTPHeaders
+from tornado.httpclient import HTTPClient, HTTPRequest, HTTPResponse, HTTPError
+from tornado.ioloop import IOLoop
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+try:
+    # libcurl keeps connections alive and reuses them between requests,
+    # which `SimpleAsyncHTTPClient` does not do (as of Tornado 4.5).
+    import pycurl
+except ImportError:
+    pycurl = None
+else:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+
+
+log = logging.getLogger(__name__)
+
+
+class EndpointStats:
+    """Latency and error counters for a single API endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = None
+
+    @property
+    def mean_time(self):
+        if self.requests:
+            return self.total_time / self.requests
+
+    def add(self, elapsed, error=False):
+        self.requests += 1
+        self.errors += bool(error)
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.last_time = elapsed
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'mean_time': self.mean_time,
+            'max_time': self.max_time,
+            'last_time': self.last_time,
+        }
+
+    def __repr__(self):
+        return '<EndpointStats {}>'.format(self.as_dict())
+
+
+class HTTPTransport:
+    """
+    Shared, pooled HTTP transport.
+
+    :param max_clients: maximum number of concurrent requests,
+                        further requests are queued
+    :param connect_timeout: connection timeout in seconds
+    :param request_timeout: default request timeout in seconds
+    :param timeouts: ``{path: request_timeout}`` per-endpoint overrides
+    :param headers: headers sent with every request
+
+    """
+
+    def __init__(self, max_clients=4, connect_timeout=5, request_timeout=15,
+                 timeouts=None, headers=None):
+        self.max_clients = max_clients
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.timeouts = dict(timeouts or {})
+        self.headers = dict(headers or {})
+        self.stats = {}
+        self._async_client = None
+        self._sync_client = None
+
+    @property
+    def client_class(self):
+        return CurlAsyncHTTPClient if pycurl else SimpleAsyncHTTPClient
+
+    @property
+    def async_client(self):
+        """Lazily created so that it binds to the running `IOLoop`."""
+        if self._async_client is None:
+            self._async_client = self.client_class(
+                force_instance=True,
+                max_clients=self.max_clients,
+            )
+        return self._async_client
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            self._sync_client = HTTPClient(
+                async_client_class=self.client_class,
+                max_clients=self.max_clients,
+            )
+        return self._sync_client
+
+    def get_request(self, url, path, method, body=None):
+        return HTTPRequest(
+            url=url,
+            method=method,
+            body=body,
+            headers=self.headers,
+            connect_timeout=self.connect_timeout,
+            request_timeout=self.timeouts.get(path, self.request_timeout),
+        )
+
+    def fetch(self, url, path, method, body=None):
+        """Fetch asynchronously; return a `Future` of the `HTTPResponse`.
+
+        HTTP errors are not raised but left on the response
+        (``response.error``) for the caller to deal with.
+
+        """
+        request = self.get_request(url, path, method, body)
+        start = time.monotonic()
+        future = self.async_client.fetch(request, raise_error=False)
+        future.add_done_callback(
+            lambda f: self._record(path, start, f))
+        return future
+
+    def fetch_sync(self, url, path, method, body=None):
+        """Fetch synchronously; return the `HTTPResponse`."""
+        request = self.get_request(url, path, method, body)
+        start = time.monotonic()
+        try:
+            response = self.sync_client.fetch(request, raise_error=False)
+        except Exception:
+            self.add_stats(path, time.monotonic() - start, error=True)
+            raise
+        self.add_stats(path, time.monotonic() - start,
+                       error=bool(response.error))
+        return response
+
+    def _record(self, path, start, future):
+        error = future.exception() or future.result().error
+        self.add_stats(path, time.monotonic() - start, error=bool(error))
+
+    def add_stats(self, path, elapsed, error=False):
+        """Count a request to `path` that took `elapsed` seconds.
+
+        For wrappers answering some requests themselves (e.g.,
+        `cointrol.trader.paper.PaperTransport`).
+
+        """
+        try:
+            stats = self.stats[path]
+        except KeyError:
+            stats = self.stats[path] = EndpointStats()
+        stats.add(elapsed, error=error)
+        log.debug('%s took %.3fs (error=%s)', path, elapsed, error)
+
+    def close(self):
+        if self._async_client is not None:
+            self._async_client.close()
+            self._async_client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+
+# Signing parameters, which are never recorded nor used for matching.
+AUTH_PARAMS = {'key', 'signature', 'nonce'}
+
+
+def get_exchange_key(method, url, body=None):
+    """Return the key that identifies a request when replaying."""
+    params = sorted((name, value) for name, value in parse_qsl(body or '')
+                    if name not in AUTH_PARAMS)
+    return ' '.join([method, url, json.dumps(params)])
+
+
+class RecordingTransport(HTTPTransport):
+    """
+    `HTTPTransport` that records all exchanges to a `path` for replaying.
+
+    The file is gzipped JSON, one exchange per line.
+
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._file = gzip.open(path, 'at', encoding='utf8')
+
+    def fetch(self, url, path, method, body=None):
+        start = time.monotonic()
+        future = super().fetch(url, path, method, body)
+        future.add_done_callback(lambda f: f.exception() or self._write(
+            method, url, body, f.result(), time.monotonic() - start))
+        return future
+
+    def fetch_sync(self, url, path, method, body=None):
+        start = time.monotonic()
+        response = super().fetch_sync(url, path, method, body)
+        self._write(method, url, body, response, time.monotonic() - start)
+        return response
+
+    def _write(self, method, url, body, response, elapsed):
+        self._file.write(json.dumps({
+            'key': get_exchange_key(method, url, body),
+            'code': response.code,
+            'content_type': response.headers.get('Content-Type'),
+            'body': (response.body or b'').decode('utf8', 'replace'),
+            'time': round(elapsed, 4),
+        }) + '\n')
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class ReplayTransport(HTTPTransport):
+    """
+    Serves exchanges recorded by `RecordingTransport`, without network.
+
+    Responses to the same request are served in the recorded order.
+
+    :param latency: ``'recorded'`` to delay responses by the recorded
+                    time, or a number of seconds
+    :param repeat: keep serving the last response to a request once the
+                   recorded ones have run out, instead of failing
+
+    """
+
+    def __init__(self, path, latency='recorded', repeat=True, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.repeat = repeat
+        self.exchanges = defaultdict(deque)
+        with gzip.open(path, 'rt', encoding='utf8') as f:
+            for line in f:
+                exchange = json.loads(line)
+                self.exchanges[exchange['key']].append(exchange)
+
+    def fetch(self, url, path, method, body=None):
+        response, delay = self._replay(url, path, method, body)
+        future = Future()
+        if delay:
+            IOLoop.current().call_later(delay, future.set_result, response)
+        else:
+            future.set_result(response)
+        return future
+
+    def fetch_sync(self, url, path, method, body=None):
+        response, delay = self._replay(url, path, method, body)
+        time.sleep(delay)
+        return response
+
+    def _replay(self, url, path, method, body):
+        key = get_exchange_key(method, url, body)
+        recorded = self.exchanges.get(key)
+        if not recorded:
+            raise LookupError('no recorded exchange for %s' % key)
+        if len(recorded) > 1 or not self.repeat:
+            exchange = recorded.popleft()
+        else:
+            exchange = recorded[0]
+        if self.latency == 'recorded':
+            delay = exchange['time']
+        else:
+            delay = self.latency
+        request = self.get_request(url, path, method, body)
+        code = exchange['code']
+        response = HTTPResponse(
+            request, code,
+            headers=HTTPHeaders({'Content-Type': exchange['content_type']
+                                 or 'text/plain'}),
+            buffer=io.BytesIO(exchange['body'].encode('utf8')),
+            error=HTTPError(code) if code >= 400 else None,
+            request_time=delay,
+        )
+        self.add_stats(path, delay, error=code >= 400)
+        return response, delay
@@ -3,42 +3,121 @@ Async workers for Bitstamp API polling, trading, etc.
 
 """
 import logging
-from itertools import groupby
-from operator import itemgetter
 
 import redis
 from django.conf import settings
-from django.db.models import Q
-from django.utils import timezone
 from django.db.models.query import QuerySet
-from tornado.gen import coroutine, Task
+from tornado import gen
+from tornado.gen import coroutine
 from tornado.ioloop import IOLoop
+from tornado.locks import Event
 
 from cointrol.utils import json
-from cointrol.core.models import Transaction, User, Order, Ticker, Balance
+from cointrol.core.models import User, Order, Ticker
 from cointrol.core import serializers
 from . import bitstamp
+from . import events
 from . import strategies
-
-
-redis_client = redis.Redis()
+from . import indicators
+from . import paper
+from . import ratelimit
+from .stream import MarketStream
+from .scheduler import Scheduler, ORDER_OPEN, NEAR_FILL
+from .state import AccountState
+from .persistence import TickerWriter, save_transactions
+from .executor import BlockingExecutor
+from .publisher import RedisPublisher
+from .sync import TransactionSync
+from .transport import HTTPTransport, RecordingTransport
+from .ratelimit import RateLimiter
+from .nonce import NonceSequencer, RedisNonceStore
+
+
+redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool(
+    **settings.COINTROL_REDIS_POOL))
 log = logging.getLogger(__name__)
 
 # TODO: support multiple users/accounts
 account = User.objects.get().account
-bitstamp_client = bitstamp.BitstampClient(username=account.username,
-                                          key=account.api_key,
-                                          secret=account.api_secret)
+state = AccountState(account, TickerWriter(**settings.COINTROL_TICKER_BUFFER))
+state.load()
+if settings.COINTROL_BITSTAMP_RECORD:
+    transport = RecordingTransport(settings.COINTROL_BITSTAMP_RECORD,
+                                   **settings.COINTROL_BITSTAMP_TRANSPORT)
+else:
+    transport = HTTPTransport(**settings.COINTROL_BITSTAMP_TRANSPORT)
+if settings.COINTROL_PAPER_TRADING and not settings.COINTROL_DO_TRADE:
+    paper_exchange = paper.PaperExchange(
+        first_id=paper.get_first_id(), **settings.COINTROL_PAPER_TRADING)
+    transport = paper.PaperTransport(transport, paper_exchange)
+else:
+    paper_exchange = None
+# Database and Redis calls block, so they run on these.
+db = BlockingExecutor('db', **settings.COINTROL_DB_EXECUTOR)
+redis_executor = BlockingExecutor('redis', **settings.COINTROL_REDIS_EXECUTOR)
+bitstamp_client = bitstamp.AsyncBitstampClient(
+    username=account.username,
+    key=account.api_key,
+    secret=account.api_secret,
+    root=settings.COINTROL_BITSTAMP_API_URL,
+    transport=transport,
+    rate_limiter=RateLimiter(**settings.COINTROL_BITSTAMP_RATE_LIMIT),
+    nonces=NonceSequencer(RedisNonceStore(
+        redis_client, key='cointrol:nonce:{}'.format(account.api_key)),
+        executor=redis_executor),
+    timeout=settings.COINTROL_BITSTAMP_TIMEOUT,
+)
+scheduler = Scheduler(rate_limiter=bitstamp_client.rate_limiter)
+publisher = RedisPublisher(redis_client, redis_executor,
+                           **settings.COINTROL_REDIS_PUBLISHER)
+# Indicators of the live ticker for the strategies, warmed up with the
+# latest saved tickers.
+market = indicators.Market(size=settings.COINTROL_MARKET_HISTORY)
+for ticker in reversed(Ticker.objects.order_by('-timestamp')
+                       .only('last', 'volume')
+                       [:settings.COINTROL_MARKET_HISTORY]):
+    market.update(ticker.last, ticker.volume)
+bus = events.EventBus()
+bus.subscribe(events.TickerUpdated,
+              lambda event: scheduler.set_price(event.ticker['last']))
+bus.subscribe(events.TickerUpdated,
+              lambda event: market.update(event.ticker['last'],
+                                          event.ticker['volume']))
+if paper_exchange:
+    bus.subscribe(events.TickerUpdated,
+                  lambda event: paper_exchange.follow(event.ticker['last']))
 
 
 class Worker:
     """Abstract async worker"""
+    # Minimum number of seconds between runs.
     timeout = 3
+    # Seconds between runs after backing off while idle.
+    max_timeout = None
+    # {urgency: timeout} caps, see `scheduler.Scheduler`.
+    urgent_timeouts = {}
+    # Event classes that end the current sleep and trigger a run.
+    wake_on = ()
+    # {event class: seconds} minimum time from the end of the last run
+    # before an event of the class in `wake_on` triggers another one.
+    wake_intervals = {}
 
     def __init__(self):
         self.log = log.getChild(type(self).__name__.replace('Watcher', ''))
+        self.schedule = scheduler.register(
+            type(self).__name__,
+            interval=self.timeout,
+            max_interval=self.max_timeout,
+            urgent_intervals=self.urgent_timeouts,
+        )
         self.reset()
         self.is_running = False
+        self._run_once = None
+        self._last_run = None
+        self._deferred_wake = None
+        self._wakeup = Event()
+        for event_class in self.wake_on:
+            bus.subscribe(event_class, self.wake)
 
     @property
     def successes(self):
@@ -49,7 +128,10 @@ class Worker:
         raise NotImplementedError
 
     def run_once(self):
-        return self.run_forever(until_number_of_successes=1)
+        """Run until success; concurrent callers share the same run."""
+        if self._run_once is None or self._run_once.done():
+            self._run_once = self.run_forever(until_number_of_successes=1)
+        return self._run_once
 
     @coroutine
     def run_forever(self, until_number_of_successes=None):
@@ -66,19 +148,17 @@ class Worker:
         while not self.should_stop:
             try:
                 result = yield self.work()
-            except Exception as e:
+            except Exception:
                 result = None
                 self.failures += 1
-                if isinstance(e, bitstamp.InvalidNonceError):
-                    # Anything > info would send an email.
-                    self.log.info('invalid nonce', exc_info=True)
-                else:
-                    self.log.exception('work failed')
+                self.log.exception('work failed')
                 self.log.info('will try again')
             else:
                 self.log.debug('work success')
             finally:
                 self.iterations += 1
+                self.schedule.done()
+                self._last_run = IOLoop.current().time()
 
             if (until_number_of_successes is not None
                     and self.successes >= until_number_of_successes):
@@ -98,6 +178,7 @@ class Worker:
         self.iterations = 0
         self.failures = 0
 
+    @coroutine
     def publish(self, model_or_models):
         if isinstance(model_or_models, QuerySet):
             models = list(model_or_models)
@@ -105,20 +186,76 @@ class Worker:
             models = [model_or_models]
         else:
             models = model_or_models
+        # Serializers may query related objects.
+        change = yield db.submit(self._serialize_change, models)
+        self._publish_change(change)
+
+    @coroutine
+    def publish_batch(self, *model_lists):
+        """Publish lists of models of different types as one change."""
+        changes = yield db.submit(lambda: [
+            self._serialize_change(models)
+            for models in model_lists if models
+        ])
+        self._publish_change({'type': 'batch', 'changes': changes})
+
+    def _serialize_change(self, models):
         model = models[0]
         serializer_class = serializers.MAPPING[type(model)]
-        msg = json.dumps({
+        return {
             'type': type(model).__name__,
             'models': serializer_class(models, many=True).data
-        })
+        }
+
+    def _publish_change(self, change):
+        msg = json.dumps(change)
         self.log.debug('publishing change "%s": %s', msg)
-        redis_client.publish('model_changes', msg)
+        publisher.publish('model_changes', msg)
+
+    def wake(self, event=None):
+        """End the current (or next) sleep early."""
+        interval = self.wake_intervals.get(type(event))
+        if interval is not None:
+            self._wake_throttled(event, interval)
+            return
+        self.log.debug('woken up by %r', event)
+        self.schedule.active()
+        self._wakeup.set()
+
+    def _wake_throttled(self, event, interval):
+        """
+        Wake up `interval` seconds after the last run at the earliest.
+
+        Frequent events (e.g., ticks) then trigger at most one run per
+        `interval`, and don't count as changes for the schedule.
+
+        """
+        if self._deferred_wake is not None:
+            return
+        loop = IOLoop.current()
+        wait = 0
+        if self._last_run is not None:
+            wait = self._last_run + interval - loop.time()
+
+        def wake():
+            self._deferred_wake = None
+            self.log.debug('woken up by %r', event)
+            self._wakeup.set()
+
+        if wait > 0:
+            self._deferred_wake = loop.call_later(wait, wake)
+        else:
+            wake()
 
     @coroutine
     def sleep(self):
-        self.log.debug('sleeping for %d seconds', self.timeout)
-        yield Task(IOLoop.instance().add_timeout,
-                   IOLoop.instance().time() + self.timeout)
+        delay = scheduler.get_delay(self.schedule)
+        self.log.debug('sleeping for %.1f seconds', delay)
+        try:
+            yield self._wakeup.wait(timeout=IOLoop.current().time() + delay)
+        except gen.TimeoutError:
+            pass
+        self._wakeup.clear()
         self.log.debug('woken up')
 
 
@@ -129,7 +266,25 @@ class Monitoring(Worker):
 
     @coroutine
     def work(self):
-        redis_client.publish('monitoring', json.dumps({'type': 'beacon'}))
+        beacon = json.dumps({
+            'type': 'beacon',
+            'bitstamp': {
+                path: stats.as_dict()
+                for path, stats in bitstamp_client.transport.stats.items()
+            },
+            'rate_limit_tokens': bitstamp_client.rate_limiter.bucket.tokens,
+            'coalesced': {
+                'shared': bitstamp_client.single_flight.shared,
+                'reused': bitstamp_client.single_flight.reused,
+            },
+            'events': dict(bus.published),
+            'executors': {
+                executor.name: executor.stats()
+                for executor in [db, redis_executor]
+            },
+            'publisher': publisher.stats(),
+        })
+        publisher.publish('monitoring', beacon)
 
 
 class BalanceWatcher(Worker):
@@ -139,82 +294,148 @@ class BalanceWatcher(Worker):
 
     @coroutine
     def work(self):
-        current = yield Task(bitstamp_client.account_balance)
+        current = yield bitstamp_client.account_balance()
 
-        try:
-            latest = account.balances.latest()
-        except Balance.DoesNotExist:
-            differs = True
-        else:
-            differs = any(getattr(latest, k) != v for k, v in current.items())
+        latest = state.balance
+        differs = latest is None or any(
+            getattr(latest, k) != v for k, v in current.items())
 
         if not differs:
             self.log.debug('no balance change')
         else:
             self.log.info('current balance differs from latest, saving, %r',
                           current)
-            self.publish(account.balances.create(
-                inferred=False,
-                timestamp=timezone.now(),
-                **current
-            ))
+            balance = yield db.submit(state.save_balance, **current)
+            yield self.publish(balance)
+            bus.publish(events.BalanceChanged(balance))
 
 
 class Trader(Worker):
     # TODO: most of the logic here should be moved to `.strategies`.
 
-    def get_trade_action(self, session):
-        try:
-            latest_order = Order.objects\
-                .filter(status=Order.PROCESSED).latest()
-        except Order.DoesNotExist:
-            latest_order = None
-        strategy = strategies.get_for_session(session, latest_order)
+    # Orders open on the exchange, set by `OrdersWatcher` before each run.
+    open_orders = ()
+
+    def get_strategy(self, session):
+        strategy = strategies.get_for_session(
+            session, state.last_processed_order, market)
+        self.log.info('trading strategy: %s', type(strategy).__name__)
+        return strategy
+
+    def get_trade_action(self, strategy):
         trade_action = strategy.get_trade_action()
-        self.log.info('trading strategy: %s, trade_action: %s',
-                      type(strategy).__name__, trade_action)
+        self.log.info('trade_action: %s', trade_action)
         return trade_action
 
+    def can_execute(self):
+        if paper_exchange:
+            self.log.info('settings.COINTROL_PAPER_TRADING; paper trading')
+        elif not settings.COINTROL_DO_TRADE:
+            self.log.info('settings.COINTROL_DO_TRADE=False; not executing')
+            return False
+        else:
+            self.log.info('settings.COINTROL_DO_TRADE=True; executing')
+        return True
+
     @coroutine
     def work(self):
+        """
+        Return ``(trading_session, open_orders, placed)`` with the orders
+        open on the exchange after trading and those placed for the
+        session, or `None` if there was no trade.
 
-        trading_session = account.get_active_trading_session()
+        """
+        trading_session = yield db.submit(account.get_active_trading_session)
         self.log.info('active trading session: %r', trading_session)
         if not trading_session:
             return
 
-        trade_action = self.get_trade_action(trading_session)
-        if not trade_action:
+        strategy = yield db.submit(self.get_strategy, trading_session)
+        if isinstance(strategy, strategies.GridStrategy):
+            result = yield self.work_grid(trading_session, strategy)
+            return result
+        if self.open_orders:
+            # The last order, or ones created manually, are still open.
             return
-        yield balance_watcher.run_once()
-        balance = account.balances.filter(inferred=False).latest()
-        ticker = Ticker.objects.latest()
 
-        fee_multiplier = (100 - balance.fee) / 100
-        if trade_action.action == Order.SELL:
-            order_task = bitstamp_client.sell_limit_order
-            amount = balance.btc_available * fee_multiplier
-            price = max(trade_action.price, ticker.ask)
-        elif trade_action.action == Order.BUY:
-            order_task = bitstamp_client.buy_limit_order
-            amount = ((balance.usd_available / trade_action.price)
-                      * fee_multiplier)
-            price = min(trade_action.price, ticker.bid)
-        else:
-            raise TypeError(trade_action)
-
-        price = round(price, 2)
-        amount = round(amount, 8)
+        trade_action = self.get_trade_action(strategy)
+        if not trade_action:
+            return
+        # Refresh the balance and get current prices at the same time.
+        _, ticker = yield bitstamp_client.gather(
+            balance_watcher.run_once(), bitstamp_client.ticker())
+        price, amount = strategies.get_order_size(
+            trade_action, state.balance, ticker)
+        order_task = self.get_order_task(trade_action)
         # Warn to send email.
         self.log.warning('trade task: %s(amount=%s, price=%s)',
                          order_task.__name__, amount, price)
 
-        if not settings.COINTROL_DO_TRADE:
-            self.log.info('settings.COINTROL_DO_TRADE=False; not executing')
+        if not self.can_execute():
+            return
+        open_order_response = yield order_task(amount=amount, price=price)
+        return trading_session, [open_order_response], [open_order_response]
+
+    @coroutine
+    def work_grid(self, trading_session, strategy):
+        """Cancel and place a batch of the grid's orders concurrently."""
+        # Orders not placed for the session (e.g., manually) are left alone.
+        session_orders, other_orders = state.get_session_orders(
+            self.open_orders, trading_session)
+        _, ticker = yield bitstamp_client.gather(
+            balance_watcher.run_once(), bitstamp_client.ticker())
+        plan = strategy.get_plan(session_orders, ticker, state.balance,
+                                 limit=self.get_batch_size())
+        if not plan:
+            return
+        # Warn to send email.
+        self.log.warning('grid: %s', plan)
+        if not self.can_execute():
+            return
+
+        cancelled, placed = yield [
+            bitstamp_client.gather(*[
+                self._try(bitstamp_client.cancel_order(order_id))
+                for order_id in plan.cancel]),
+            bitstamp_client.gather(*[
+                self._try(self.get_order_task(action)(
+                    amount=amount, price=action.price))
+                for action, amount in plan.place]),
+        ]
+        cancelled_ids = {order_id for order_id, result
+                         in zip(plan.cancel, cancelled) if result is True}
+        open_orders = [order for order in session_orders + other_orders
+                       if order.id not in cancelled_ids]
+        placed = [order for order in placed if order]
+        return trading_session, open_orders + placed, placed
+
+    def get_batch_size(self):
+        """
+        Return the number of order requests for this run: up to
+        `settings.COINTROL_GRID_BATCH`, without dipping into the rate
+        limiter's reserve for normal requests.
+
+        """
+        rate_limiter = bitstamp_client.rate_limiter
+        spare = (rate_limiter.bucket.tokens
+                 - rate_limiter.get_needed_tokens(ratelimit.NORMAL))
+        return max(1, min(settings.COINTROL_GRID_BATCH, int(spare)))
+
+    def get_order_task(self, trade_action):
+        if trade_action.action == Order.SELL:
+            return bitstamp_client.sell_limit_order
         else:
-            self.log.info('settings.COINTROL_DO_TRADE=True; executing')
-            open_order_response = yield Task(order_task, amount=amount, price=price)
-            return trading_session, open_order_response
+            return bitstamp_client.buy_limit_order
+
+    @coroutine
+    def _try(self, request):
+        """Return the result of `request`, or `None` if it failed."""
+        try:
+            result = yield request
+        except bitstamp.BitstampError as e:
+            self.log.warning('order request failed: %r', e)
+            return None
+        return result
 
 
 balance_watcher = BalanceWatcher()
@@ -224,34 +445,26 @@ trader = Trader()
 class TransactionsWatcher(Worker):
 
     timeout = 15
+    max_timeout = 60
+    urgent_timeouts = {ORDER_OPEN: 10, NEAR_FILL: 3}
+    wake_on = (events.OrderClosed,)
+
+    def reset(self):
+        super().reset()
+        self.sync = TransactionSync(bitstamp_client)
 
     @coroutine
     def get_new_transactions(self):
         """Return new transactions sorted by created asc."""
         self.log.info('getting new transactions')
-        try:
-            latest = account.transactions.latest()
-        except Transaction.DoesNotExist:
-            latest = None
+        latest = state.latest_transaction
         self.log.debug('local latest transaction: %r', latest)
-        offset = 0
-        new_transactions = []
-        done = False
-        while not done:
-            page = yield Task(bitstamp_client.user_transactions,
-                              offset=offset, limit=10, )
-            offset += 10
-            if not page:
-                break
-            for transaction in page:
-                if latest and transaction['id'] == latest.pk:
-                    done = True
-                    break
-                new_transactions.append(transaction)
+        new_transactions = yield self.sync.fetch_new(
+            high_water_mark=latest.pk if latest else None)
         if new_transactions:
             self.log.info('%d new transactions: %r',
                           len(new_transactions), new_transactions)
-        return list(reversed(new_transactions))
+        return new_transactions
 
     @coroutine
     def work(self):
@@ -260,42 +473,16 @@ class TransactionsWatcher(Worker):
 
         if not new_transactions:
             return
+        self.schedule.active()
 
-        by_order = groupby(new_transactions, itemgetter('order_id'))
-        for order_id, transaction_group in by_order:
-            transaction_group = [
-                Transaction(account=account, **transaction)
-                for transaction in transaction_group
-            ]
-            if order_id:
-                usd = sum(t.usd for t in transaction_group)
-                btc = sum(t.btc for t in transaction_group)
-                dt = min(t.datetime for t in transaction_group)
-                try:
-                    order = account.orders.get(pk=order_id)
-                except Order.DoesNotExist:
-                    # Most like a historical order.
-                    order = Order(
-                        account=account,
-                        pk=order_id,
-                        datetime=dt,
-                        type=Order.SELL if usd > 0 else Order.BUY,
-                        status=Order.PROCESSED,
-                    )
-                    self.log.info('order for transaction group does not exist')
-                order.amount += abs(btc)
-                order.price = abs(usd / order.amount)
-                order.total += abs(usd)
-                order.save()
-                self.publish(order)
-                for transaction in transaction_group:
-                    transaction.save()
-                order.balance = transaction_group[-1].balance
-                order.save()
-            else:
-                for transaction in transaction_group:
-                    transaction.save()
-            self.publish(transaction_group)
+        transactions, orders = yield db.submit(
+            save_transactions, account, new_transactions, state.get_order)
+        state.transactions_saved(transactions)
+        for order in orders:
+            if order.status == Order.PROCESSED:
+                state.order_processed(order)
+            bus.publish(events.OrderFilled(order))
+        yield self.publish_batch(orders, transactions)
 
         yield balance_watcher.run_once()
         self.log.info('end syncing transactions')
@@ -303,93 +490,114 @@ class TransactionsWatcher(Worker):
 
 class OrdersWatcher(Worker):
 
-    timeout = 10
+    timeout = 5
+    max_timeout = 30
+    urgent_timeouts = {ORDER_OPEN: 5, NEAR_FILL: 2}
+    wake_on = (events.OrderFilled, events.SessionActivated,
+               events.TickerUpdated)
+    # Let the trader act on new prices without polling the open
+    # orders on every tick.
+    wake_intervals = {events.TickerUpdated: 5}
 
     @coroutine
     def work(self):
-        open_orders_response = yield Task(bitstamp_client.open_orders)
+        open_orders_response = yield bitstamp_client.open_orders()
 
         self.log.info('%s open orders: %r',
                       len(open_orders_response),
                       open_orders_response)
 
-        if open_orders_response:
-            # There are orders, but they must have been created manually.
-            trading_session = None
+        # The trader may place or cancel orders, which we process
+        # immediately in this run.
+        trader.open_orders = open_orders_response
+        result = yield trader.run_once()
+        self.log.info('trader returned orders: %r', result)
+        if result:
+            trading_session, open_orders_response, placed = result
+        elif open_orders_response:
+            # Orders we have seen before, or created manually.
+            trading_session, placed = None, ()
         else:
-            # No open orders - run trader: may create and return an open order,
-            # which we process immediately in  this run.
-            self.log.info('no orders, invoking trader')
-            result = yield trader.run_once()
-            self.log.info('trader returned order: %r', result)
-            if not result:
-                return
-            trading_session, placed_order_response = result
-            open_orders_response = [placed_order_response]
-
-        if open_orders_response:
-            for order in open_orders_response:
-                if not Order.objects.filter(pk=order.id).exists():
-                    self.log.info('saving %r', order)
-                    order = account.orders.create(
-                        trading_session=trading_session,
-                        id=order.id,
-                        price=order.price,
-                        amount=order.amount,
-                        type=order.type,
-                        datetime=order.datetime,
-                        balance=account.balances.latest(),
-                        status=Order.OPEN,
-                    )
-                    self.publish(order)
-                    self.log.info('saved %r', order)
-
-        has_changes = yield self.update_existing_orders(
-            open_order_ids=[order.id for order in open_orders_response])
-
-        if open_orders_response or has_changes:
-            yield balance_watcher.run_once()
+            return
 
-    @coroutine
-    def update_existing_orders(self, open_order_ids):
-
-        now = timezone.now()
-
-        # OPEN => PROCESSED
-        now_processed = account.orders\
-            .filter(status=Order.OPEN)\
-            .exclude(Q(id__in=open_order_ids) | Q(transactions=None))
-        now_processed_ids = list(now_processed.values_list('id', flat=True))
-        if now_processed_ids:
-            now_processed.update(status=Order.PROCESSED, status_changed=now)
-
-        # OPEN => CANCELLED
-        now_cancelled = account.orders\
-            .filter(status=Order.OPEN, transactions=None)\
-            .exclude(id__in=open_order_ids)
-        now_cancelled_ids = list(now_cancelled.values_list('id', flat=True))
-        if now_cancelled_ids:
-            now_cancelled.update(status=Order.CANCELLED, status_changed=now)
-
-        # Publish the updated ones.
-        now_updated_ids = now_processed_ids + now_cancelled_ids
-        if now_updated_ids:
-            now_updated_orders = Order.objects.filter(id__in=now_updated_ids)
-            self.publish(now_updated_orders)
+        delta = yield db.submit(
+            state.reconcile_orders, open_orders_response,
+            trading_session=trading_session, placed=placed)
+        if delta.changed:
+            yield self.publish(delta.changed)
+        for order in delta.placed:
+            bus.publish(events.OrderPlaced(order))
+        if delta.closed:
+            bus.publish(events.OrderClosed([o.pk for o in delta.closed]))
+
+        scheduler.set_open_orders(
+            order.price for order in open_orders_response)
+        if open_orders_response or delta:
+            self.schedule.active()
             yield balance_watcher.run_once()
 
-        return bool(now_updated_ids)
-
 
 class TickerWatcher(Worker):
 
     timeout = 3
+    max_timeout = 10
+    urgent_timeouts = {NEAR_FILL: 2}
 
     @coroutine
     def work(self):
         self.log.debug('getting ticker')
-        ticker = yield Task(bitstamp_client.ticker)
-        if not Ticker.objects.filter(timestamp=ticker.timestamp).exists():
-            ticker = Ticker.objects.create(**ticker)
-            self.publish(ticker)
+        ticker = yield bitstamp_client.ticker()
+        saved = yield db.submit(state.save_ticker, **ticker)
+        if saved:
+            self.schedule.active()
+            bus.publish(events.TickerUpdated(ticker))
+            ticker = saved
+            yield self.publish(ticker)
             self.log.debug('saved %r', ticker)
+
+
+class TickerStreamer(Worker):
+    """Saves & publishes the live ticker from the WebSocket feed."""
+
+    # Minimum number of seconds between saved tickers.
+    timeout = 1
+
+    def __init__(self):
+        super().__init__()
+        self.stream = MarketStream(bitstamp_client.ticker,
+                                   url=settings.COINTROL_BITSTAMP_STREAM_URL)
+
+    @coroutine
+    def work(self):
+        if not self.stream.is_running:
+            self.stream.start()
+        if self.stream.ticker.ready:
+            current = self.stream.ticker.snapshot()
+            ticker = yield db.submit(state.save_ticker, **current)
+            if ticker:
+                bus.publish(events.TickerUpdated(current))
+                yield self.publish(ticker)
+                self.log.debug('saved %r', ticker)
+                return
+        # Wait for the next update instead of polling.
+        yield self.stream.changed.wait(timeout=IOLoop.current().time() + 60)
+
+
+class SessionWatcher(Worker):
+    """Announces newly activated trading sessions (no API calls)."""
+
+    timeout = 5
+
+    def __init__(self):
+        super().__init__()
+        self.session_id = None
+
+    @coroutine
+    def work(self):
+        session = yield db.submit(account.get_active_trading_session)
+        session_id = session.pk if session else None
+        if session_id != self.session_id:
+            self.session_id = session_id
+            if session:
+                self.log.info('session activated: %r', session)
+                bus.publish(events.SessionActivated(session))